@@ -0,0 +1,112 @@
+import hashlib
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def chunk_fingerprint(chunk_ids: List[str], variant: str = "") -> str:
+    """Stable fingerprint of the retrieved chunks (and answer variant) an answer was generated from"""
+    return hashlib.sha1("\x1f".join([variant] + chunk_ids).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Semantic cache of generated answers.
+    
+    An entry matches when the retrieved chunk IDs are identical and the query
+    embedding is within `similarity_threshold` cosine similarity of the cached
+    query. Entries are evicted LRU beyond `max_entries` and expire after
+    `ttl_seconds`. The whole cache is dropped when the collection version
+    changes, i.e. after any ingestion or deletion.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._keys = itertools.count()
+        self._collection_version = None
+        self._lock = threading.Lock()
+    
+    def _check_version(self, collection_version):
+        if collection_version != self._collection_version:
+            self._entries.clear()
+            self._collection_version = collection_version
+    
+    def lookup(self, query_embedding: List[float], chunk_ids: List[str],
+               collection_version, variant: str = "") -> Optional[Dict]:
+        """Return the cached answer for a similar query over the same chunks, if any.
+        
+        `variant` separates answers generated differently for the same chunks
+        (e.g. brief voice answers vs full ones).
+        """
+        fingerprint = chunk_fingerprint(chunk_ids, variant)
+        query_vector = _normalize(query_embedding)
+        now = time.time()
+        
+        with self._lock:
+            self._check_version(collection_version)
+            
+            best_key, best_similarity = None, self.similarity_threshold
+            for key, entry in list(self._entries.items()):
+                if now - entry["created"] > self.ttl_seconds:
+                    del self._entries[key]
+                    self.evictions += 1
+                    continue
+                if entry["fingerprint"] != fingerprint:
+                    continue
+                similarity = sum(a * b for a, b in zip(query_vector, entry["embedding"]))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+            
+            if best_key is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key]["answer"]
+    
+    def store(self, query_embedding: List[float], chunk_ids: List[str],
+              collection_version, answer: Dict, variant: str = ""):
+        """Cache an answer generated for this query embedding and chunk set"""
+        fingerprint = chunk_fingerprint(chunk_ids, variant)
+        
+        with self._lock:
+            self._check_version(collection_version)
+            self._entries[next(self._keys)] = {
+                "fingerprint": fingerprint,
+                "embedding": _normalize(query_embedding),
+                "answer": answer,
+                "created": time.time()
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
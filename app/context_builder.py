@@ -0,0 +1,137 @@
+"""Context assembly between retrieval and generation.
+
+Ingestion produces 1000-char windows with 200-char overlap, so neighbouring
+chunks retrieved together repeat text. `pack_context` merges adjacent chunks
+from the same source, drops duplicate spans, orders passages with MMR so one
+guideline doesn't crowd out the others, and packs them to a token budget.
+"""
+import re
+from typing import Dict, List, Optional
+
+from lexical_index import tokenize
+
+# Treat passages from the same guideline as this similar at minimum, to favour source diversity
+SAME_SOURCE_SIMILARITY = 0.5
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough GPT token count (~4 chars per token for English prose)"""
+    return max(1, len(text) // 4)
+
+
+def merge_overlap(left: str, right: str, probe: int = 40, max_overlap: int = 400) -> str:
+    """Join two consecutive chunks, removing the text they share at the seam"""
+    head = right[:probe]
+    pos = left.rfind(head, max(0, len(left) - max_overlap))
+    if pos != -1 and right.startswith(left[pos:]):
+        return left[:pos] + right
+    return left + "\n" + right
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _merge_adjacent(candidates: List[Dict]) -> List[Dict]:
+    by_source = {}
+    for candidate in candidates:
+        by_source.setdefault(candidate["source"], []).append(candidate)
+    
+    passages = []
+    for source, items in by_source.items():
+        items.sort(key=lambda c: (c["chunk_id"] is None, c["chunk_id"] or 0))
+        current = None
+        for item in items:
+            if (current is not None and item["chunk_id"] is not None
+                    and current["last_chunk_id"] is not None
+                    and item["chunk_id"] == current["last_chunk_id"] + 1):
+                current["text"] = merge_overlap(current["text"], item["text"])
+                current["chunk_ids"].append(item["id"])
+                current["last_chunk_id"] = item["chunk_id"]
+                current["distance"] = min(current["distance"], item["distance"])
+                if current["page"] is None:
+                    current["page"] = item["page"]
+                continue
+            current = {
+                "source": source,
+                "text": item["text"],
+                "page": item["page"],
+                "distance": item["distance"],
+                "chunk_ids": [item["id"]],
+                "last_chunk_id": item["chunk_id"]
+            }
+            passages.append(current)
+    return passages
+
+
+def _drop_duplicates(passages: List[Dict]) -> List[Dict]:
+    """Drop passages whose text is contained in a more relevant (or longer) passage"""
+    kept = []
+    for passage in sorted(passages, key=lambda p: (-len(p["text"]), p["distance"])):
+        normalized = _normalize(passage["text"])
+        if any(normalized in other["_normalized"] for other in kept):
+            continue
+        passage["_normalized"] = normalized
+        kept.append(passage)
+    for passage in kept:
+        del passage["_normalized"]
+    return kept
+
+
+def _mmr_order(passages: List[Dict], mmr_lambda: float) -> List[Dict]:
+    token_sets = [set(tokenize(p["text"])) for p in passages]
+    relevance = [1.0 / (1.0 + p["distance"]) for p in passages]
+    
+    def similarity(i, j):
+        union = token_sets[i] | token_sets[j]
+        jaccard = len(token_sets[i] & token_sets[j]) / len(union) if union else 0.0
+        if passages[i]["source"] == passages[j]["source"]:
+            return max(jaccard, SAME_SOURCE_SIMILARITY)
+        return jaccard
+    
+    remaining = list(range(len(passages)))
+    selected = []
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max(
+            (similarity(i, j) for j in selected), default=0.0))
+        selected.append(best)
+        remaining.remove(best)
+    return [passages[i] for i in selected]
+
+
+def pack_context(documents: List[str], metadatas: List[Dict], distances: List[float],
+                 ids: Optional[List[str]] = None, token_budget: int = 1500,
+                 mmr_lambda: float = 0.7) -> List[Dict]:
+    """Assemble retrieved chunks into passages that fit the prompt token budget.
+    
+    Returns passages (dicts with text, source, page, distance, chunk_ids) in the
+    order they should appear in the prompt.
+    """
+    ids = ids or [f"chunk_{i}" for i in range(len(documents))]
+    candidates = [
+        {
+            "id": chunk_id,
+            "text": document,
+            "source": (metadata or {}).get("source", chunk_id),
+            "chunk_id": (metadata or {}).get("chunk_id"),
+            "page": (metadata or {}).get("page"),
+            "distance": distance
+        }
+        for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+    ]
+    
+    passages = _mmr_order(_drop_duplicates(_merge_adjacent(candidates)), mmr_lambda)
+    
+    packed, used = [], 0
+    for passage in passages:
+        tokens = estimate_tokens(passage["text"])
+        if used + tokens > token_budget:
+            if packed:
+                continue
+            # Always send at least the start of the best passage
+            passage["text"] = passage["text"][:token_budget * 4]
+            tokens = estimate_tokens(passage["text"])
+        passage.pop("last_chunk_id", None)
+        packed.append(passage)
+        used += tokens
+    return packed
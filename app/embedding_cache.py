@@ -0,0 +1,100 @@
+"""Disk cache of chunk embeddings for ingestion.
+
+Forced re-ingests, rebuilt collections and chunking experiments produce
+many of the same chunk texts as earlier runs: the unchanged parts of a
+revised guideline, or a chunk size tried before. Their vectors are kept in
+a SQLite file keyed by (embedding model id, sha256 of the text), so only
+text that has never been embedded goes through the model. Vectors are
+stored as raw float32.
+"""
+import hashlib
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+# Stay well under SQLite's bound-parameter limit on older builds
+LOOKUP_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_id(embedding_function) -> str:
+    """Identifies the model behind an embedding function, so vectors from different models never mix"""
+    name = getattr(embedding_function, "MODEL_NAME", None)
+    return f"{type(embedding_function).__name__}:{name}" if name else type(embedding_function).__name__
+
+
+class EmbeddingCache:
+    """SQLite table of (model, sha256) -> float32 vector"""
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, sha256 TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, sha256)) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Cached vectors for whichever of `hashes` are present"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_BATCH):
+                batch = list(hashes[start:start + LOOKUP_BATCH])
+                placeholders = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT sha256, vector FROM embeddings WHERE model = ? AND sha256 IN ({placeholders})",
+                    [self.model] + batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, hashes: Sequence[str], vectors: Sequence):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, sha256, vector) VALUES (?, ?, ?)",
+                [(self.model, key, np.asarray(vector, dtype=np.float32).tobytes())
+                 for key, vector in zip(hashes, vectors)]
+            )
+            self._db.commit()
+
+    def embed(self, texts: List[str], embedding_function: Callable) -> List[np.ndarray]:
+        """Vectors for `texts`, computing (and storing) only those not cached yet"""
+        hashes = [text_hash(text) for text in texts]
+        cached = self.get_many(sorted(set(hashes)))
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = embedding_function(list(missing.values()))
+            computed = dict(zip(missing, (np.asarray(v, dtype=np.float32) for v in vectors)))
+            self.put_many(list(computed), list(computed.values()))
+            cached.update(computed)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [cached[key] for key in hashes]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"entries": self.count(), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,35 +1,309 @@
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+import itertools
+import json
 import os
-from typing import List, Dict
+import threading
+import time
+import uuid
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Optional
+
+from embedding_cache import EmbeddingCache, model_id
+from lexical_index import BM25Index, reciprocal_rank_fusion
+
+# Chunks embedded and written per bulk_upsert batch; bounds ingest memory
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", 128))
+
+# Written next to the collection on every change to it; readers key caches on its version
+VERSION_NAME = "collection_version.json"
 
 class ChromaDBClient:
     def __init__(self):
         db_path = os.getenv("CHROMADB_PATH", "./cache/chromadb")
+        self.db_path = db_path
         self.client = chromadb.PersistentClient(path=db_path)
         
+        # Same model Chroma uses by default (all-MiniLM-L6-v2), held explicitly so
+        # query embeddings can be computed once and reused (e.g. by the answer cache)
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        
         # Create or get collection for JTS protocols
         self.collection = self.client.get_or_create_collection(
             name="jts_protocols",
-            metadata={"description": "Joint Trauma System Clinical Practice Guidelines"}
+            metadata={"description": "Joint Trauma System Clinical Practice Guidelines"},
+            embedding_function=self.embedding_function
         )
+        
+        # BM25 index over the same chunks, stored next to the vector collection
+        self.lexical_index_path = os.path.join(db_path, "bm25_index.json")
+        self.lexical_index = None
+        self._lexical_mtime = None  # mtime_ns of the index file lexical_index was loaded from
+        self._lexical_lock = threading.Lock()
+        
+        self.version_path = os.path.join(db_path, VERSION_NAME)
+        self._version = None  # (file mtime_ns, version) last read
+        
+        # Chunk vectors from earlier ingests, outside the collection directory so
+        # they survive deleting it to rebuild with different chunking
+        self.embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", "./cache/embedding_cache.sqlite3")
+        self.embedding_cache = None
+    
+    def bump_collection_version(self):
+        """Record that the collection changed (a fresh random version, safe with concurrent writers)"""
+        tmp_path = f"{self.version_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": uuid.uuid4().hex, "updated_at": time.time()}, f)
+        os.replace(tmp_path, self.version_path)
+    
+    def get_collection_version(self) -> str:
+        """Version of the collection's contents; changes whenever any process writes to it.
+        
+        Only the version file's mtime is checked per call. Collections written
+        before the version file existed fall back to the document count.
+        """
+        try:
+            mtime = os.stat(self.version_path).st_mtime_ns
+        except FileNotFoundError:
+            return f"count:{self.collection.count()}"
+        if self._version is None or self._version[0] != mtime:
+            with open(self.version_path) as f:
+                self._version = (mtime, json.load(f)["version"])
+        return self._version[1]
     
-    def add_documents(self, documents: List[str], metadatas: List[Dict], ids: List[str]):
-        """Add documents to the vector database"""
+    def get_embedding_cache(self) -> EmbeddingCache:
+        if self.embedding_cache is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.embedding_cache_path)), exist_ok=True)
+            self.embedding_cache = EmbeddingCache(self.embedding_cache_path, model_id(self.embedding_function))
+        return self.embedding_cache
+    
+    def embed_documents(self, documents: List[str]) -> List[np.ndarray]:
+        """Chunk embeddings, reusing cached vectors for text embedded before"""
+        return self.get_embedding_cache().embed(documents, self.embedding_function)
+    
+    def add_documents(self, documents: List[str], metadatas: List[Dict], ids: List[str],
+                      embeddings: Optional[List] = None):
+        """Add documents to the vector database.
+        
+        Without precomputed embeddings they are embedded (through the
+        embedding cache) and written in UPSERT_BATCH_SIZE batches.
+        """
+        if embeddings is None:
+            self.bulk_upsert({"id": chunk_id, "document": document, "metadata": metadata}
+                             for chunk_id, document, metadata in zip(ids, documents, metadatas))
+            return
         self.collection.add(
             documents=documents,
             metadatas=metadatas,
-            ids=ids
+            ids=ids,
+            embeddings=embeddings
         )
+        self.bump_collection_version()
     
-    def query(self, query_text: str, n_results: int = 5) -> Dict:
-        """Query the vector database"""
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=n_results
-        )
+    @staticmethod
+    def _read_checkpoints(checkpoint_path: Optional[str]) -> Dict[str, int]:
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return {}
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    
+    @staticmethod
+    def _write_checkpoints(checkpoint_path: str, checkpoints: Dict[str, int]):
+        if not checkpoints:
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+            return
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoints, f)
+        os.replace(tmp_path, checkpoint_path)
+    
+    def checkpoint_committed(self, checkpoint_path: Optional[str], key: str) -> int:
+        """Chunks already committed by an interrupted bulk_upsert with this key (0 if none)"""
+        return self._read_checkpoints(checkpoint_path).get(key, 0)
+    
+    def bulk_upsert(self, chunks: Iterable[Dict], batch_size: int = UPSERT_BATCH_SIZE,
+                    checkpoint_path: Optional[str] = None, checkpoint_key: str = "",
+                    on_batch: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Embed and upsert a stream of chunks ({id, document, metadata}) batch by batch.
+        
+        Only one batch is held in memory and a failure loses at most that
+        batch. With `checkpoint_path`, the number of chunks committed is saved
+        after every batch under `checkpoint_key`; calling again with the same
+        key (and the same chunk order) skips them. The key's entry is removed
+        once every chunk is in. `on_batch` gets each batch's stats: batch,
+        chunks, embed_ms, write_ms, chunks_per_s. Returns the totals.
+        """
+        committed = self.checkpoint_committed(checkpoint_path, checkpoint_key)
+        totals = {"chunks": 0, "skipped": committed, "batches": 0, "embed_ms": 0.0, "write_ms": 0.0}
+        start = time.perf_counter()
+        remaining = itertools.islice(chunks, committed, None)
+        
+        while True:
+            batch = list(itertools.islice(remaining, batch_size))
+            if not batch:
+                break
+            documents = [chunk["document"] for chunk in batch]
+            
+            embed_start = time.perf_counter()
+            embeddings = self.embed_documents(documents)
+            write_start = time.perf_counter()
+            self.collection.upsert(
+                ids=[chunk["id"] for chunk in batch],
+                documents=documents,
+                metadatas=[chunk["metadata"] for chunk in batch],
+                embeddings=embeddings
+            )
+            self.bump_collection_version()
+            write_end = time.perf_counter()
+            
+            committed += len(batch)
+            if checkpoint_path:
+                checkpoints = self._read_checkpoints(checkpoint_path)
+                checkpoints[checkpoint_key] = committed
+                self._write_checkpoints(checkpoint_path, checkpoints)
+            
+            stats = {
+                "batch": totals["batches"] + 1,
+                "chunks": len(batch),
+                "embed_ms": (write_start - embed_start) * 1000,
+                "write_ms": (write_end - write_start) * 1000,
+                "chunks_per_s": len(batch) / max(write_end - embed_start, 1e-9)
+            }
+            totals["batches"] += 1
+            totals["chunks"] += len(batch)
+            totals["embed_ms"] += stats["embed_ms"]
+            totals["write_ms"] += stats["write_ms"]
+            if on_batch:
+                on_batch(stats)
+        
+        if checkpoint_path:
+            checkpoints = self._read_checkpoints(checkpoint_path)
+            if checkpoints.pop(checkpoint_key, None) is not None:
+                self._write_checkpoints(checkpoint_path, checkpoints)
+        totals["chunks_per_s"] = totals["chunks"] / max(time.perf_counter() - start, 1e-9)
+        return totals
+    
+    def delete_documents(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Delete documents by ID or metadata filter"""
+        self.collection.delete(ids=ids, where=where)
+        self.bump_collection_version()
+    
+    def embed_query(self, query_text: str) -> List[float]:
+        """Embed a query with the collection's embedding model"""
+        return [float(x) for x in self.embedding_function([query_text])[0]]
+    
+    def rebuild_lexical_index(self, batch_size: int = 1000) -> BM25Index:
+        """Build the BM25 index from every chunk in the collection and save it"""
+        ids, documents = [], []
+        offset = 0
+        while True:
+            batch = self.collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            ids.extend(batch["ids"])
+            # Index the source filename too so CPG IDs ("ID86") and titles match
+            documents.extend(
+                f"{(metadata or {}).get('source', '')} {document}"
+                for document, metadata in zip(batch["documents"], batch["metadatas"])
+            )
+            offset += len(batch["ids"])
+        
+        index = BM25Index.build(ids, documents)
+        index.save(self.lexical_index_path)
+        with self._lexical_lock:
+            self.lexical_index = index
+            self._lexical_mtime = os.stat(self.lexical_index_path).st_mtime_ns
+        return index
+    
+    def get_lexical_index(self) -> Optional[BM25Index]:
+        """The BM25 index as last written by ingestion, reloaded whenever the file changes.
+        
+        Never built on the query path: until an ingest (or
+        rebuild_lexical_index) has written the file, queries run vector-only.
+        While one thread loads a new file, others keep using the old index.
+        """
+        try:
+            mtime = os.stat(self.lexical_index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self.lexical_index is not None and self._lexical_mtime == mtime:
+            return self.lexical_index
+        
+        if not self._lexical_lock.acquire(blocking=self.lexical_index is None):
+            return self.lexical_index
+        try:
+            if self.lexical_index is None or self._lexical_mtime != mtime:
+                self.lexical_index = BM25Index.load(self.lexical_index_path)
+                self._lexical_mtime = mtime
+            return self.lexical_index
+        finally:
+            self._lexical_lock.release()
+    
+    def query(self, query_text: str, n_results: int = 5,
+              query_embedding: Optional[List[float]] = None, mode: str = "vector") -> Dict:
+        """Query the vector database, reusing a precomputed query embedding if given.
+        
+        mode="hybrid" fuses the vector ranking with BM25 lexical ranking using
+        reciprocal rank fusion, so exact drug names, doses and CPG IDs are found
+        even when the embedding misses them.
+        """
+        if mode == "hybrid":
+            return self._hybrid_query(query_text, n_results, query_embedding)
+        
+        if query_embedding is not None:
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results
+            )
+        else:
+            results = self.collection.query(
+                query_texts=[query_text],
+                n_results=n_results
+            )
         return results
     
+    def _hybrid_query(self, query_text: str, n_results: int,
+                      query_embedding: Optional[List[float]]) -> Dict:
+        if query_embedding is None:
+            query_embedding = self.embed_query(query_text)
+        candidates = max(n_results * 4, 20)
+        
+        vector = self.collection.query(query_embeddings=[query_embedding], n_results=candidates)
+        vector_ids = vector["ids"][0] if vector["ids"] else []
+        
+        lexical_index = self.get_lexical_index()
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(query_text, candidates)] if lexical_index else []
+        
+        fused_ids = reciprocal_rank_fusion([vector_ids, lexical_ids])[:n_results]
+        
+        found = {
+            chunk_id: (document, metadata, distance)
+            for chunk_id, document, metadata, distance in zip(
+                vector_ids, vector["documents"][0], vector["metadatas"][0], vector["distances"][0]
+            )
+        }
+        
+        # Lexical-only hits: fetch them and compute the same (squared L2) distance Chroma reports
+        missing = [chunk_id for chunk_id in fused_ids if chunk_id not in found]
+        if missing:
+            extra = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            for chunk_id, document, metadata, embedding in zip(
+                extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]
+            ):
+                distance = float(np.sum((np.asarray(embedding, dtype=np.float32) - query_vector) ** 2))
+                found[chunk_id] = (document, metadata, distance)
+        
+        fused_ids = [chunk_id for chunk_id in fused_ids if chunk_id in found]
+        return {
+            "ids": [fused_ids],
+            "documents": [[found[chunk_id][0] for chunk_id in fused_ids]],
+            "metadatas": [[found[chunk_id][1] for chunk_id in fused_ids]],
+            "distances": [[found[chunk_id][2] for chunk_id in fused_ids]]
+        }
+    
     def get_collection_count(self) -> int:
         """Get number of documents in collection"""
         return self.collection.count()
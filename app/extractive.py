@@ -0,0 +1,88 @@
+"""Extractive answers for when generation misses its deadline.
+
+Built straight from the retrieved passages with no model call. Each sentence
+is scored by the share of the query's terms it covers, with terms that are
+rare among the retrieved sentences weighted up. Sentences that carry a dose
+get a small bonus, and later-ranked passages a small penalty. The best few
+are returned in reading order with their source.
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, List
+
+from lexical_index import tokenize
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n{2,}|\n(?=\s*(?:[-*•]|\d+[.)])\s)")
+# Reference-list entries match query terms well but tell a medic nothing
+REFERENCE_PATTERN = re.compile(r"\bet al\b|\bdoi\b|https?://|\b(?:19|20)\d{2};|\b(?:trial|study|review)\.$", re.I)
+DOSE_PATTERN = re.compile(r"\d+(?:\.\d+)?\s*(?:mg|mcg|g|gm|ml|meq|iu|units?|%)\b", re.I)
+
+MIN_SENTENCE_WORDS = 4
+MAX_SENTENCE_WORDS = 60
+DOSE_BONUS = 0.15
+RANK_PENALTY = 0.1  # Per passage rank
+
+HEADER = "Protocol excerpts (no AI summary yet; check the full answer when it arrives):"
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences and list items of a chunk within the word limits, minus reference entries"""
+    sentences = []
+    for piece in SENTENCE_SPLIT.split(text):
+        sentence = " ".join(piece.split())
+        if (MIN_SENTENCE_WORDS <= len(sentence.split()) <= MAX_SENTENCE_WORDS
+                and not REFERENCE_PATTERN.search(sentence)):
+            sentences.append(sentence)
+    return sentences
+
+
+def score_sentences(query: str, passages: List[Dict]) -> List[Dict]:
+    """Every sentence of the passages with its score against the query, best first"""
+    candidates = []
+    for rank, passage in enumerate(passages):
+        for position, sentence in enumerate(split_sentences(passage["text"])):
+            candidates.append({"text": sentence, "terms": set(tokenize(sentence)), "rank": rank,
+                               "position": position, "source": passage["source"], "page": passage.get("page")})
+
+    query_terms = set(tokenize(query))
+    if not candidates or not query_terms:
+        return []
+
+    document_frequency = Counter(term for candidate in candidates for term in candidate["terms"] & query_terms)
+    weights = {term: math.log(1 + len(candidates) / (1 + document_frequency[term])) for term in query_terms}
+    total_weight = sum(weights.values())
+
+    for candidate in candidates:
+        coverage = sum(weights[term] for term in candidate["terms"] & query_terms) / total_weight
+        bonus = DOSE_BONUS if coverage and DOSE_PATTERN.search(candidate["text"]) else 0.0
+        candidate["score"] = (coverage + bonus) / (1 + RANK_PENALTY * candidate["rank"])
+    return sorted(candidates, key=lambda candidate: candidate["score"], reverse=True)
+
+
+def extractive_answer(query: str, passages: List[Dict], max_sentences: int = 3) -> str:
+    """Answer text made of the best-matching sentences, each cited with its source"""
+    chosen = []
+    seen = set()
+    for candidate in score_sentences(query, passages):
+        key = candidate["text"].lower()
+        if candidate["score"] <= 0 or key in seen:
+            continue
+        seen.add(key)
+        chosen.append(candidate)
+        if len(chosen) == max_sentences:
+            break
+
+    if not chosen:
+        # Nothing matched lexically; the top passage is still the best retrieval had
+        sentences = split_sentences(passages[0]["text"]) if passages else []
+        if not sentences:
+            return HEADER
+        chosen = [{"text": sentences[0], "rank": 0, "position": 0, "source": passages[0]["source"],
+                   "page": passages[0].get("page")}]
+
+    lines = [HEADER]
+    for candidate in sorted(chosen, key=lambda candidate: (candidate["rank"], candidate["position"])):
+        citation = candidate["source"] + (f", p. {candidate['page']}" if candidate["page"] else "")
+        lines.append(f"- {candidate['text']} ({citation})")
+    return "\n".join(lines)
@@ -0,0 +1,91 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from heapq import nlargest
+from typing import Dict, List, Tuple
+
+# Keeps doses ("2.5"), units ("mg") and CPG IDs ("id86") as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is",
+    "it", "of", "on", "or", "the", "to", "what", "when", "which", "with"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over the chunk collection.
+    
+    Per-posting BM25 weights are precomputed at build time, so a search is
+    just a sum over the postings of the query terms.
+    """
+    
+    def __init__(self, ids: List[str], postings: Dict[str, Tuple[List[int], List[float]]]):
+        self.ids = ids
+        self.postings = postings
+    
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        term_counts = [Counter(tokenize(doc)) for doc in documents]
+        lengths = [sum(counts.values()) for counts in term_counts]
+        avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        
+        document_frequency = Counter()
+        for counts in term_counts:
+            document_frequency.update(counts.keys())
+        
+        n_docs = len(documents)
+        postings = {}
+        for doc_index, (counts, length) in enumerate(zip(term_counts, lengths)):
+            norm = k1 * (1 - b + b * length / avg_length) if avg_length else k1
+            for term, tf in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                doc_list, weights = postings.setdefault(term, ([], []))
+                doc_list.append(doc_index)
+                weights.append(round(idf * tf * (k1 + 1) / (tf + norm), 4))
+        
+        return cls(list(ids), postings)
+    
+    def search(self, query_text: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """Return (chunk id, BM25 score) pairs, best first"""
+        scores = {}
+        for term in set(tokenize(query_text)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            for doc_index, weight in zip(*posting):
+                scores[doc_index] = scores.get(doc_index, 0.0) + weight
+        
+        best = nlargest(n_results, scores.items(), key=lambda item: item[1])
+        return [(self.ids[doc_index], score) for doc_index, score in best]
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ids": self.ids, "postings": self.postings}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["ids"], {term: tuple(posting) for term, posting in data["postings"].items()})
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuse several ranked ID lists; each contributes 1 / (k + rank) per ID"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
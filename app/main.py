@@ -1,43 +1,172 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, List
+import asyncio
+import json
 import os
 import sys
+import time
+import httpx
+import openai
 from dotenv import load_dotenv
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__)))
 
 from embeddings import ChromaDBClient
-from openai_client import OpenAIClient
+from openai_client import OpenAIClient, TTS_MODEL
+from answer_cache import AnswerCache
+from tts_cache import TTSCache
+from context_builder import pack_context
+from extractive import extractive_answer
+from voice_format import condense_for_voice, speak_brief
+from metrics import (StageTimer, registry, STAGE_LATENCY, REQUEST_LATENCY, IN_FLIGHT,
+                     REQUESTS, TOKENS, ERRORS, ANSWER_CACHE, TTS_CACHE, WS_SESSIONS,
+                     MODEL_TIER)
 
 load_dotenv()
 
-app = FastAPI(title="CDSS Cloud API", version="1.0.0")
+# Upper bound on queries doing retrieval + generation at once; extra requests wait their turn
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", 16))
+query_slots = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
 
-try:
-    chroma_client = ChromaDBClient()
-    openai_client = OpenAIClient()
-    print("✅ ChromaDB and OpenAI clients initialized successfully")
-except Exception as e:
-    print(f"⚠️ Warning: Could not initialize clients: {e}")
-    chroma_client = None
-    openai_client = None
+# "hybrid" fuses BM25 lexical and vector rankings (see lexical_index.py); "vector" is dense only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Chunks retrieved per query, then merged/deduplicated and packed to the prompt token budget
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 6))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+
+# Semantic cache of generated answers (see answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 256)),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_S", 3600)),
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+)
+
+# Synthesized speech for repeated phrases (greetings, errors, common answers) is replayed from disk
+tts_cache = TTSCache(
+    os.getenv("TTS_CACHE_DIR", "./cache/tts"),
+    max_bytes=int(os.getenv("TTS_CACHE_MAX_MB", 200)) * 1024 * 1024
+)
+
+# Generations still running after their request's deadline_ms answered extractively;
+# held here until they finish and their answer is cached. They no longer hold a query
+# slot, so at most MAX_BACKGROUND_GENERATIONS run at once; others are cancelled
+MAX_BACKGROUND_GENERATIONS = int(os.getenv("MAX_BACKGROUND_GENERATIONS", 4))
+background_generations = set()
+
+# /voice: largest accepted upload (a 15 s Opus query is ~50 KB) and the allowed TTS voices
+MAX_VOICE_UPLOAD_BYTES = int(os.getenv("MAX_VOICE_UPLOAD_BYTES", 5 * 1024 * 1024))
+TTS_VOICES = {"alloy", "echo", "fable", "onyx", "nova", "shimmer"}
+
+# /ws: close sessions that send nothing (not even a ping) for this long
+WS_IDLE_TIMEOUT_S = float(os.getenv("WS_IDLE_TIMEOUT_S", 60))
+# /ws: audio uploads a session may have open at once (each capped at MAX_VOICE_UPLOAD_BYTES)
+WS_MAX_OPEN_UPLOADS = int(os.getenv("WS_MAX_OPEN_UPLOADS", 2))
+
+NO_RESULTS_TEXT = "No relevant protocols found in the database."
+
+# Query used to load the embedding model and open the vector/BM25 indexes before traffic arrives
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "tranexamic acid dose for hemorrhage")
+
+# Created by the background warm-up started in lifespan(); None until then (or if it failed)
+chroma_client = None
+openai_client = None
+readiness = {"state": "starting", "stage": None, "error": None, "warmup_ms": None}
+
+async def _warm_up():
+    """Build the clients and pay every first-query cost, then mark the server ready.
+    
+    Stages: ChromaDB client, OpenAI client on a pooled HTTP client, the
+    embedding model (ONNX session), then a full retrieval so the HNSW and
+    BM25 indexes are loaded. /ready reports 200 only after all of them.
+    """
+    global chroma_client, openai_client
+    start = time.perf_counter()
+    try:
+        readiness["stage"] = "chromadb"
+        chroma_client = await run_in_threadpool(ChromaDBClient)
+        
+        readiness["stage"] = "openai"
+        # One keep-alive pool sized for the query limit, so concurrent queries reuse warm TLS connections
+        openai_client = OpenAIClient(http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_QUERIES * 2,
+                max_keepalive_connections=MAX_CONCURRENT_QUERIES
+            )
+        ))
+        
+        readiness["stage"] = "embedding_model"
+        await run_in_threadpool(chroma_client.embed_query, WARMUP_QUERY)
+        
+        readiness["stage"] = "warmup_query"
+        await _retrieve(WARMUP_QUERY, StageTimer())
+        
+        readiness.update(state="ready", stage=None, warmup_ms=int((time.perf_counter() - start) * 1000))
+        print(f"✅ ChromaDB and OpenAI clients initialized, warm-up took {readiness['warmup_ms']}ms")
+    except Exception as e:
+        readiness.update(state="failed", error=str(e))
+        print(f"⚠️ Warning: Startup warm-up failed at {readiness['stage']}: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the server answers /health and /ready at once
+    warm_up = asyncio.create_task(_warm_up())
+    yield
+    warm_up.cancel()
+    # Finish abandoned generations before their client goes away, or they fail with connection errors
+    pending = list(background_generations)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if openai_client:
+        await openai_client.close()
+
+app = FastAPI(title="CDSS Cloud API", version="1.0.0", lifespan=lifespan)
 
 class QueryRequest(BaseModel):
     query: str
     device_id: str
     timestamp: Optional[str] = None
+    voice_mode: Optional[str] = None  # "brief": short structured answer for speech
+    deadline_ms: Optional[int] = None  # Answer extractively if generation can't finish by then
 
 class Source(BaseModel):
     title: str
     page: Optional[int] = None
     confidence: float
 
+class Timings(BaseModel):
+    """Server-side time spent in each stage of the query pipeline, in ms"""
+    transcribe_ms: int = 0
+    embed_ms: int = 0
+    search_ms: int = 0
+    context_ms: int = 0
+    cache_lookup_ms: int = 0
+    prompt_ms: int = 0
+    llm_ms: int = 0
+    serialize_ms: int = 0
+    total_ms: int = 0
+
+class BriefAnswer(BaseModel):
+    """Structured voice_mode="brief" answer"""
+    summary: str
+    actions: List[str] = []
+    doses: List[str] = []
+
 class QueryResponse(BaseModel):
     response: str
     sources: List[Source]
     query_type: str
     processing_time_ms: int
+    cache_hit: bool = False
+    model_tier: Optional[str] = None  # "fast" or "strong"; None when no model was called
+    brief: Optional[BriefAnswer] = None
+    timings: Optional[Timings] = None
 
 @app.get("/")
 async def root():
@@ -55,54 +184,672 @@ async def health_check():
         except:
             pass
     
+    status = {"ready": "healthy", "starting": "starting", "failed": "degraded"}[readiness["state"]]
+    
     return {
-        "status": "healthy",
+        "status": status,
         "chromadb": chromadb_status,
         "openai_api": openai_status,
         "documents_indexed": doc_count,
+        "answer_cache": answer_cache.stats(),
+        "tts_cache": tts_cache.stats(),
         "version": "1.0.0"
     }
 
-@app.post("/query")
+@app.get("/ready")
+async def ready_check():
+    """Readiness for load balancers: 200 once warm-up has finished, 503 before (or if it failed)"""
+    if readiness["state"] == "ready":
+        return {"ready": True, "warmup_ms": readiness["warmup_ms"]}
+    return JSONResponse(status_code=503, content={
+        "ready": False,
+        "state": readiness["state"],
+        "stage": readiness["stage"],
+        "error": readiness["error"]
+    })
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics"""
+    for stat, value in answer_cache.stats().items():
+        if stat != "hit_rate":
+            ANSWER_CACHE.set(value, stat=stat)
+    for stat, value in tts_cache.stats().items():
+        if stat != "hit_rate":
+            TTS_CACHE.set(value, stat=stat)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def _search(query: str, n_results: int, timer: StageTimer) -> dict:
+    with timer.stage("embed"):
+        query_embedding = chroma_client.embed_query(query)
+    with timer.stage("search"):
+        results = chroma_client.query(query, n_results=n_results, query_embedding=query_embedding,
+                                      mode=RETRIEVAL_MODE)
+        # Changes on every write to the collection, including same-size revisions of a CPG
+        collection_version = chroma_client.get_collection_version() if ANSWER_CACHE_ENABLED else None
+    
+    documents = results["documents"][0] if results["documents"] else []
+    metadatas = results["metadatas"][0] if results["metadatas"] else []
+    distances = results["distances"][0] if results["distances"] else []
+    ids = results["ids"][0] if results["ids"] else []
+    
+    with timer.stage("context"):
+        passages = pack_context(documents, metadatas, distances, ids, token_budget=CONTEXT_TOKEN_BUDGET)
+    
+    return {
+        "passages": passages,
+        "ids": ids,
+        "query_embedding": query_embedding,
+        "collection_version": collection_version
+    }
+
+async def _retrieve(query: str, timer: StageTimer, n_results: int = CONTEXT_CANDIDATES) -> dict:
+    """Embed the query, run the ChromaDB search and pack the results into prompt context"""
+    # ChromaDB is synchronous (embedding + HNSW search), keep it off the event loop
+    return await run_in_threadpool(_search, query, n_results, timer)
+
+def _cache_variant(voice_mode: Optional[str]) -> str:
+    # Brief and full answers to the same query are cached separately
+    return "brief" if voice_mode == "brief" else ""
+
+def _cached_answer(retrieval: dict, timer: StageTimer, voice_mode: Optional[str] = None) -> Optional[dict]:
+    """Cached {response, brief} for this retrieval, if any"""
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with timer.stage("cache_lookup"):
+        return answer_cache.lookup(retrieval["query_embedding"], retrieval["ids"],
+                                   retrieval["collection_version"], variant=_cache_variant(voice_mode))
+
+def _cache_answer(retrieval: dict, response_text: str, brief: Optional[dict] = None,
+                  voice_mode: Optional[str] = None):
+    if ANSWER_CACHE_ENABLED and response_text:
+        answer_cache.store(retrieval["query_embedding"], retrieval["ids"],
+                           retrieval["collection_version"], {"response": response_text, "brief": brief},
+                           variant=_cache_variant(voice_mode))
+
+def _build_sources(passages: List[dict]) -> List[dict]:
+    sources = []
+    for passage in passages:
+        confidence = max(0.0, 1.0 - passage["distance"])
+        sources.append({
+            "title": passage["source"],
+            "page": passage["page"],
+            "confidence": round(confidence, 2)
+        })
+    return sources
+
+def _context_documents(retrieval: dict) -> List[str]:
+    return [passage["text"] for passage in retrieval["passages"]]
+
+def _retrieval_confidence(retrieval: dict) -> float:
+    """Confidence of the best passage, on the same scale as the response sources"""
+    return max(1.0 - passage["distance"] for passage in retrieval["passages"])
+
+def _remaining_s(timer: StageTimer, deadline_ms: Optional[int]) -> Optional[float]:
+    """Seconds left before a request's deadline, or None without one"""
+    if deadline_ms is None:
+        return None
+    return max(0.0, deadline_ms - timer.elapsed_ms()) / 1000
+
+def _fallback_data(query: str, retrieval: dict) -> dict:
+    return {"text": extractive_answer(query, retrieval["passages"]), "query_type": "extractive_fallback"}
+
+def _finish_in_background(task: asyncio.Task, retrieval: dict, device_id: str, voice_mode: Optional[str]):
+    """Let a generation that missed its deadline complete and cache its answer for the next asker"""
+    if not ANSWER_CACHE_ENABLED or len(background_generations) >= MAX_BACKGROUND_GENERATIONS:
+        # Its answer would be thrown away, or enough abandoned completions already hold OpenAI connections
+        task.cancel()
+        return
+    background_generations.add(task)
+    
+    def done(task: asyncio.Task):
+        background_generations.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            print(f"⚠️ Background generation failed: {task.exception()}")
+            return
+        generation = task.result()
+        _record_generation(StageTimer(), generation, device_id)
+        _cache_answer(retrieval, generation["response"], generation.get("brief"), voice_mode)
+    
+    task.add_done_callback(done)
+
+async def _until_deadline(tokens: AsyncIterator[str], remaining_s: Optional[float]) -> AsyncIterator[Optional[str]]:
+    """Pass a token stream through, first yielding None if its first token misses the deadline"""
+    if remaining_s is not None:
+        first = asyncio.ensure_future(tokens.__anext__())
+        try:
+            done, _ = await asyncio.wait({first}, timeout=remaining_s)
+            if not done:
+                yield None
+            token = await first
+        except StopAsyncIteration:
+            return
+        finally:
+            first.cancel()
+        yield token
+    async for token in tokens:
+        yield token
+
+def _record_generation(timer: StageTimer, generation: dict, device_id: str):
+    """Fold an OpenAIClient result's timings and token usage into the request"""
+    timer.record("prompt", generation.get("prompt_ms", 0))
+    timer.record("llm", generation.get("llm_ms", 0))
+    TOKENS.inc(generation.get("prompt_tokens", 0), device_id=device_id, kind="prompt")
+    TOKENS.inc(generation.get("completion_tokens", 0), device_id=device_id, kind="completion")
+    if generation.get("model_tier"):
+        MODEL_TIER.inc(tier=generation["model_tier"], reason=generation["route_reason"])
+
+def _timings(timer: StageTimer) -> dict:
+    return Timings(**timer.rounded()).model_dump()
+
+def _observe(endpoint: str, device_id: str, query_type: str, timer: StageTimer):
+    for name, value in timer.timings.items():
+        STAGE_LATENCY.observe(value / 1000, stage=name[:-len("_ms")])
+    REQUEST_LATENCY.observe(timer.elapsed_ms() / 1000, endpoint=endpoint, query_type=query_type)
+    REQUESTS.inc(endpoint=endpoint, device_id=device_id, query_type=query_type)
+
+def _json_response(payload: dict, timer: StageTimer, device_id: str) -> Response:
+    """Serialize a /query payload, reporting the serialization time in its timings"""
+    with timer.stage("serialize"):
+        body = json.dumps(payload)
+    timings = _timings(timer)
+    _observe("/query", device_id, payload["query_type"], timer)
+    # Splice timings into the already-encoded body rather than encoding it twice
+    body = body[:-1] + ', "timings": ' + json.dumps(timings) + "}"
+    return Response(content=body, media_type="application/json")
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
     if not chroma_client or not openai_client:
         raise HTTPException(status_code=503, detail="Services not fully initialized")
     
+    with IN_FLIGHT.track(endpoint="/query"):
+        async with query_slots:
+            return await _answer_query(request)
+
+async def _answer(query: str, device_id: str, timer: StageTimer, voice_mode: Optional[str] = None,
+                  deadline_ms: Optional[int] = None) -> dict:
+    """Retrieve, then answer from the cache or the LLM.
+    
+    Returns {response, brief, sources, query_type, cache_hit, model_tier}. If
+    generation is still running at `deadline_ms`, the answer is extractive
+    (query_type "extractive_fallback") and generation finishes in the
+    background to fill the answer cache.
+    """
+    retrieval = await _retrieve(query, timer)
+    
+    if not retrieval["passages"]:
+        return {"response": NO_RESULTS_TEXT, "brief": None, "sources": [], "query_type": "no_results",
+                "cache_hit": False, "model_tier": None}
+    
+    sources = _build_sources(retrieval["passages"])
+    
+    cached = _cached_answer(retrieval, timer, voice_mode)
+    if cached is not None:
+        return {"response": cached["response"], "brief": cached.get("brief"), "sources": sources,
+                "query_type": "chromadb", "cache_hit": True, "model_tier": None}
+    
+    generation_task = asyncio.ensure_future(openai_client.generate_response(
+        query, _context_documents(retrieval), voice_mode, _retrieval_confidence(retrieval)))
+    try:
+        generation = await asyncio.wait_for(asyncio.shield(generation_task), _remaining_s(timer, deadline_ms))
+    except asyncio.TimeoutError:
+        _finish_in_background(generation_task, retrieval, device_id, voice_mode)
+        return {"response": _fallback_data(query, retrieval)["text"], "brief": None, "sources": sources,
+                "query_type": "extractive_fallback", "cache_hit": False, "model_tier": None}
+    except asyncio.CancelledError:
+        generation_task.cancel()
+        raise
+    _record_generation(timer, generation, device_id)
+    _cache_answer(retrieval, generation["response"], generation.get("brief"), voice_mode)
+    
+    return {"response": generation["response"], "brief": generation.get("brief"), "sources": sources,
+            "query_type": "chromadb", "cache_hit": False, "model_tier": generation["model_tier"]}
+
+async def _answer_query(request: QueryRequest):
+    timer = StageTimer()
     try:
-        results = chroma_client.query(request.query, n_results=3)
+        answer = await _answer(request.query, request.device_id, timer, request.voice_mode, request.deadline_ms)
+        return _json_response({
+            "response": answer["response"],
+            "sources": answer["sources"],
+            "query_type": answer["query_type"],
+            "processing_time_ms": timer.elapsed_ms(),
+            "cache_hit": answer["cache_hit"],
+            "model_tier": answer["model_tier"],
+            "brief": answer["brief"]
+        }, timer, request.device_id)
         
-        documents = results["documents"][0] if results["documents"] else []
-        metadatas = results["metadatas"][0] if results["metadatas"] else []
-        distances = results["distances"][0] if results["distances"] else []
+    except Exception as e:
+        ERRORS.inc(endpoint="/query", device_id=request.device_id)
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+@app.post("/query/stream")
+async def process_query_stream(request: QueryRequest):
+    """Server-sent events variant of /query.
+    
+    Emits a `sources` event as soon as retrieval finishes, a `token` event per
+    completion delta, then a final `done` event with timings (or `error`).
+    With `deadline_ms`, a `fallback` event carrying an extractive answer is
+    sent at the deadline if no token has arrived yet; the tokens still follow.
+    """
+    if not chroma_client or not openai_client:
+        raise HTTPException(status_code=503, detail="Services not fully initialized")
+    
+    return StreamingResponse(
+        _stream_answer(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _done_data(timer: StageTimer, endpoint: str, device_id: str, query_type: str, cache_hit: bool,
+               first_token_ms: int = 0, model_tier: Optional[str] = None) -> dict:
+    timings = _timings(timer)
+    _observe(endpoint, device_id, query_type, timer)
+    return {
+        "retrieval_ms": timings["embed_ms"] + timings["search_ms"],
+        "time_to_first_token_ms": first_token_ms,
+        "generation_ms": timings["llm_ms"],
+        "processing_time_ms": timings["total_ms"],
+        "cache_hit": cache_hit,
+        "model_tier": model_tier,
+        "timings": timings
+    }
+
+async def _stream_answer(request: QueryRequest):
+    async for event, data in _answer_events(request.query, request.device_id, "/query/stream",
+                                            voice_mode=request.voice_mode, deadline_ms=request.deadline_ms):
+        yield _sse_event(event, data)
+
+async def _answer_events(query: str, device_id: str, endpoint: str, timer: Optional[StageTimer] = None,
+                         voice_mode: Optional[str] = None, deadline_ms: Optional[int] = None):
+    """Streamed answer as (event, data) pairs: sources, token..., then done or error.
+    
+    Shared by the SSE endpoint and WebSocket sessions, which only differ in framing.
+    Brief answers are a single short JSON completion, so they are generated
+    whole and sent as a `brief` event plus one token with the rendered text.
+    If nothing has been generated by `deadline_ms`, a `fallback` event with
+    an extractive answer goes out first.
+    """
+    with IN_FLIGHT.track(endpoint=endpoint):
+        async with query_slots:
+            timer = timer or StageTimer()
+            try:
+                retrieval = await _retrieve(query, timer)
+                
+                if not retrieval["passages"]:
+                    yield "sources", {"sources": [], "query_type": "no_results"}
+                    yield "token", {"text": NO_RESULTS_TEXT}
+                    yield "done", _done_data(timer, endpoint, device_id, "no_results", cache_hit=False)
+                    return
+                
+                yield "sources", {
+                    "sources": _build_sources(retrieval["passages"]),
+                    "query_type": "chromadb"
+                }
+                
+                cached = _cached_answer(retrieval, timer, voice_mode)
+                if cached is not None:
+                    if cached.get("brief"):
+                        yield "brief", cached["brief"]
+                    yield "token", {"text": cached["response"]}
+                    yield "done", _done_data(timer, endpoint, device_id, "chromadb", cache_hit=True)
+                    return
+                
+                if voice_mode == "brief":
+                    generation_task = asyncio.ensure_future(openai_client.generate_response(
+                        query, _context_documents(retrieval), voice_mode, _retrieval_confidence(retrieval)))
+                    try:
+                        done, _ = await asyncio.wait({generation_task}, timeout=_remaining_s(timer, deadline_ms))
+                        if not done:
+                            yield "fallback", _fallback_data(query, retrieval)
+                        generation = await generation_task
+                    finally:
+                        generation_task.cancel()
+                    _record_generation(timer, generation, device_id)
+                    _cache_answer(retrieval, generation["response"], generation["brief"], voice_mode)
+                    yield "brief", generation["brief"]
+                    yield "token", {"text": generation["response"]}
+                    yield "done", _done_data(timer, endpoint, device_id, "chromadb", cache_hit=False,
+                                             first_token_ms=int(timer.timings.get("llm_ms", 0)),
+                                             model_tier=generation["model_tier"])
+                    return
+                
+                generation_start = time.perf_counter()
+                first_token_ms = None
+                tokens = []
+                stats = {}
+                tokens_stream = openai_client.stream_response(query, _context_documents(retrieval), stats,
+                                                              _retrieval_confidence(retrieval))
+                async for token in _until_deadline(tokens_stream, _remaining_s(timer, deadline_ms)):
+                    if token is None:
+                        yield "fallback", _fallback_data(query, retrieval)
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = int((time.perf_counter() - generation_start) * 1000)
+                    tokens.append(token)
+                    yield "token", {"text": token}
+                stats["llm_ms"] = (time.perf_counter() - generation_start) * 1000 - stats.get("prompt_ms", 0)
+                _record_generation(timer, stats, device_id)
+                _cache_answer(retrieval, "".join(tokens))
+                
+                yield "done", _done_data(timer, endpoint, device_id, "chromadb", cache_hit=False,
+                                         first_token_ms=first_token_ms or 0,
+                                         model_tier=stats.get("model_tier"))
+                
+            except Exception as e:
+                ERRORS.inc(endpoint=endpoint, device_id=device_id)
+                yield "error", {"detail": f"Error processing query: {str(e)}"}
+
+@app.post("/voice")
+async def process_voice(
+    audio: UploadFile = File(...),
+    device_id: str = Form(...),
+    voice: str = Form("echo"),
+    voice_mode: str = Form("brief"),
+    deadline_ms: Optional[int] = Form(None)
+):
+    """Whole voice round trip in one request: transcribe, answer, speak.
+    
+    The response body is one JSON line (transcript, full answer, spoken
+    summary, sources, timings) followed by the MP3 of the spoken summary,
+    streamed as it is synthesized. An edge device with a slow link makes one
+    upload instead of separate Whisper, /query and TTS calls.
+    """
+    if not chroma_client or not openai_client:
+        raise HTTPException(status_code=503, detail="Services not fully initialized")
+    if voice not in TTS_VOICES:
+        raise HTTPException(status_code=400, detail=f"Unknown voice '{voice}'")
+    
+    audio_bytes = await audio.read()
+    if not audio_bytes:
+        raise HTTPException(status_code=400, detail="Empty audio upload")
+    if len(audio_bytes) > MAX_VOICE_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio upload too large")
+    
+    timer = StageTimer()
+    with IN_FLIGHT.track(endpoint="/voice"):
+        async with query_slots:
+            try:
+                with timer.stage("transcribe"):
+                    transcript = await openai_client.transcribe(audio.filename or "query.wav", audio_bytes)
+                if not transcript:
+                    raise HTTPException(status_code=422, detail="No speech recognized in the audio")
+                answer = await _answer(transcript, device_id, timer, voice_mode, deadline_ms)
+            except HTTPException:
+                raise
+            except Exception as e:
+                ERRORS.inc(endpoint="/voice", device_id=device_id)
+                raise HTTPException(status_code=500, detail=f"Error processing voice query: {str(e)}")
+    
+    header = {
+        "transcript": transcript,
+        "response": answer["response"],
+        "voice_text": _voice_text(answer["response"], answer["brief"]),
+        "brief": answer["brief"],
+        "sources": answer["sources"],
+        "query_type": answer["query_type"],
+        "cache_hit": answer["cache_hit"],
+        "model_tier": answer["model_tier"],
+        "audio_format": "mp3",
+        "processing_time_ms": timer.elapsed_ms(),
+        "timings": _timings(timer)
+    }
+    
+    return StreamingResponse(
+        _voice_body(header, voice, timer, device_id),
+        media_type="application/octet-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _voice_text(response_text: str, brief: Optional[dict]) -> str:
+    """What to speak: the brief fields when generated in brief mode, else a condensed answer"""
+    return speak_brief(brief) if brief else condense_for_voice(response_text)
+
+async def _speech(text: str, voice: str):
+    """MP3 for `text`, replayed from the TTS cache when the phrase was synthesized before"""
+    cached = await run_in_threadpool(tts_cache.get, text, voice, TTS_MODEL)
+    if cached is not None:
+        for start in range(0, len(cached), 16384):
+            yield cached[start:start + 16384]
+        return
+    
+    chunks = []
+    async for chunk in openai_client.synthesize_speech(text, voice):
+        chunks.append(chunk)
+        yield chunk
+    await run_in_threadpool(tts_cache.put, text, voice, TTS_MODEL, b"".join(chunks))
+
+async def _voice_body(header: dict, voice: str, timer: StageTimer, device_id: str):
+    yield (json.dumps(header) + "\n").encode()
+    try:
+        with timer.stage("tts"):
+            async for chunk in _speech(header["voice_text"], voice):
+                yield chunk
+    except Exception as e:
+        # Headers are already sent; the client still has the text to display
+        ERRORS.inc(endpoint="/voice", device_id=device_id)
+        print(f"⚠️ TTS failed for /voice: {e}")
+    _observe("/voice", device_id, header["query_type"], timer)
+
+@app.websocket("/ws")
+async def websocket_session(websocket: WebSocket, device_id: str = "unknown"):
+    """Long-lived edge session: queries, answer tokens and audio multiplexed on one socket.
+    
+    Text frames are JSON objects with a `type` and, except ping/pong, a
+    client-chosen request `id`:
+    
+        client -> server: ping {ts}, query {id, query, voice_mode, deadline_ms}, speak {id, text, voice},
+                          audio {id, filename, voice, voice_mode, speak, deadline_ms}, audio_end {id},
+                          cancel {id}
+        server -> client: pong {ts}, sources/fallback/brief/token/done/error {id, ...},
+                          transcript {id, text}, voice_text {id, text},
+                          audio_start {id, format}, audio_end {id}
+    
+    Binary frames carry audio in either direction: one byte giving the id
+    length, the UTF-8 id, then the payload. Requests run concurrently, so
+    frames for different ids interleave. Edge devices keep the session open
+    across queries (see cdss_session.py), paying the TCP/TLS setup once.
+    """
+    if not chroma_client or not openai_client:
+        # 1013: try again later; the edge session reconnects with backoff
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+    with WS_SESSIONS.track():
+        await _WebSocketSession(websocket, device_id).run()
+
+def _pack_audio_frame(request_id: str, payload: bytes) -> bytes:
+    encoded = request_id.encode()
+    return bytes([len(encoded)]) + encoded + payload
+
+def _unpack_audio_frame(frame: bytes):
+    """(request id, payload) of a binary frame; ValueError if the frame is malformed"""
+    if not frame or len(frame) < 1 + frame[0]:
+        raise ValueError("Malformed audio frame")
+    length = frame[0]
+    return frame[1:1 + length].decode(), frame[1 + length:]  # UnicodeDecodeError is a ValueError
+
+class _WebSocketSession:
+    def __init__(self, websocket: WebSocket, device_id: str):
+        self.websocket = websocket
+        self.device_id = device_id
+        self.send_lock = asyncio.Lock()
+        self.tasks = {}
+        self.uploads = {}
+    
+    async def send(self, message: dict):
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(message))
+    
+    async def send_audio(self, request_id: str, chunk: bytes):
+        async with self.send_lock:
+            await self.websocket.send_bytes(_pack_audio_frame(request_id, chunk))
+    
+    async def run(self):
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.websocket.receive(), timeout=WS_IDLE_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    await self.websocket.close(code=1001, reason="Idle timeout")
+                    return
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    await self._receive_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    await self._dispatch(message["text"])
+        except Exception as e:
+            print(f"⚠️ WebSocket session for {self.device_id} ended: {e}")
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+    
+    async def _receive_audio(self, frame: bytes):
+        try:
+            request_id, chunk = _unpack_audio_frame(frame)
+        except ValueError:
+            # One bad frame must not end the session and every request multiplexed on it
+            await self.send({"type": "error", "id": None, "detail": "Malformed audio frame"})
+            return
+        upload = self.uploads.get(request_id)
+        if upload is None:
+            return
+        if upload["size"] + len(chunk) > MAX_VOICE_UPLOAD_BYTES:
+            # Drop it now rather than buffering until audio_end; later frames for it are ignored
+            del self.uploads[request_id]
+            await self.send({"type": "error", "id": request_id,
+                             "detail": f"Audio upload exceeds {MAX_VOICE_UPLOAD_BYTES} bytes"})
+            return
+        upload["chunks"].append(chunk)
+        upload["size"] += len(chunk)
+    
+    async def _dispatch(self, text: str):
+        try:
+            message = json.loads(text)
+            kind = message["type"]
+        except (ValueError, KeyError, TypeError):
+            await self.send({"type": "error", "id": None, "detail": "Malformed message"})
+            return
+        request_id = message.get("id")
         
-        if not documents:
-            return {
-                "response": "No relevant protocols found in the database.",
-                "sources": [],
-                "query_type": "no_results",
-                "processing_time_ms": 0
-            }
+        if kind in ("query", "speak", "audio") and (request_id in self.tasks or request_id in self.uploads):
+            await self.send({"type": "error", "id": request_id, "detail": "Request id already in use"})
+            return
         
-        response_text, processing_time = openai_client.generate_response(request.query, documents)
+        if kind == "ping":
+            await self.send({"type": "pong", "ts": message.get("ts")})
+        elif kind == "query":
+            self._start(request_id, self._query(request_id, message.get("query", ""),
+                                                voice_mode=message.get("voice_mode"),
+                                                deadline_ms=message.get("deadline_ms")))
+        elif kind == "speak":
+            self._start(request_id, self._speak(request_id, message.get("text", ""), message.get("voice", "echo")))
+        elif kind == "audio":
+            if request_id not in self.uploads and len(self.uploads) >= WS_MAX_OPEN_UPLOADS:
+                await self.send({"type": "error", "id": request_id, "detail": "Too many audio uploads in progress"})
+                return
+            self.uploads[request_id] = {
+                "filename": message.get("filename", "query.wav"),
+                "voice": message.get("voice", "echo"),
+                "voice_mode": message.get("voice_mode", "brief"),
+                "speak": message.get("speak", True),
+                "deadline_ms": message.get("deadline_ms"),
+                "chunks": [],
+                "size": 0
+            }
+        elif kind == "audio_end":
+            upload = self.uploads.pop(request_id, None)
+            if upload is None:
+                await self.send({"type": "error", "id": request_id, "detail": "No audio upload in progress"})
+            else:
+                self._start(request_id, self._voice(request_id, upload))
+        elif kind == "cancel":
+            task = self.tasks.get(request_id)
+            if task:
+                task.cancel()
+        else:
+            await self.send({"type": "error", "id": request_id, "detail": f"Unknown message type '{kind}'"})
+    
+    def _start(self, request_id: str, coroutine):
+        task = asyncio.create_task(self._guarded(request_id, coroutine))
+        self.tasks[request_id] = task
         
-        sources = []
-        for i, (metadata, distance) in enumerate(zip(metadatas, distances)):
-            confidence = max(0.0, 1.0 - distance)
-            sources.append({
-                "title": metadata.get("source", f"Protocol {i+1}"),
-                "page": metadata.get("page"),
-                "confidence": round(confidence, 2)
-            })
+        def finished(_):
+            if self.tasks.get(request_id) is task:
+                del self.tasks[request_id]
+        task.add_done_callback(finished)
+    
+    async def _guarded(self, request_id: str, coroutine):
+        # A request must never take the session down (e.g. sending after the client went away)
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ WebSocket request {request_id} from {self.device_id} failed: {e}")
+    
+    async def _query(self, request_id: str, query: str, timer: Optional[StageTimer] = None,
+                     voice_mode: Optional[str] = None, deadline_ms: Optional[int] = None):
+        """Stream one answer to the client; returns (answer text, brief fields or None)"""
+        tokens = []
+        brief = None
+        async for event, data in _answer_events(query, self.device_id, "/ws", timer, voice_mode, deadline_ms):
+            if event == "token":
+                tokens.append(data["text"])
+            elif event == "brief":
+                brief = data
+            await self.send({"type": event, "id": request_id, **data})
+            if event == "error":
+                return "", None
+        return "".join(tokens), brief
+    
+    async def _speak(self, request_id: str, text: str, voice: str):
+        if voice not in TTS_VOICES:
+            await self.send({"type": "error", "id": request_id, "detail": f"Unknown voice '{voice}'"})
+            return
+        await self.send({"type": "audio_start", "id": request_id, "format": "mp3"})
+        try:
+            async for chunk in _speech(text, voice):
+                await self.send_audio(request_id, chunk)
+        except Exception as e:
+            ERRORS.inc(endpoint="/ws", device_id=self.device_id)
+            await self.send({"type": "error", "id": request_id, "detail": f"TTS failed: {str(e)}"})
+        await self.send({"type": "audio_end", "id": request_id})
+    
+    async def _voice(self, request_id: str, upload: dict):
+        """Same pipeline as /voice: transcribe, stream the answer, then speak its summary"""
+        if not upload["size"]:
+            await self.send({"type": "error", "id": request_id, "detail": "Audio upload empty"})
+            return
         
-        return {
-            "response": response_text,
-            "sources": sources,
-            "query_type": "chromadb",
-            "processing_time_ms": processing_time
-        }
+        timer = StageTimer()
+        try:
+            # Counts against MAX_CONCURRENT_QUERIES like /voice; _query takes its own slot afterwards
+            async with query_slots:
+                with timer.stage("transcribe"):
+                    transcript = await openai_client.transcribe(upload["filename"], b"".join(upload["chunks"]))
+        except Exception as e:
+            ERRORS.inc(endpoint="/ws", device_id=self.device_id)
+            await self.send({"type": "error", "id": request_id, "detail": f"Transcription failed: {str(e)}"})
+            return
+        await self.send({"type": "transcript", "id": request_id, "text": transcript})
+        if not transcript:
+            await self.send({"type": "error", "id": request_id, "detail": "No speech recognized in the audio"})
+            return
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+        # Same timer as the transcription, so the deadline covers it as it does on /voice
+        answer, brief = await self._query(request_id, transcript, timer, upload["voice_mode"], upload["deadline_ms"])
+        if answer and upload["speak"]:
+            voice_text = _voice_text(answer, brief)
+            await self.send({"type": "voice_text", "id": request_id, "text": voice_text})
+            await self._speak(request_id, voice_text, upload["voice"])
 
 if __name__ == "__main__":
     import uvicorn
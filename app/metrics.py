@@ -0,0 +1,217 @@
+"""Minimal Prometheus-style metrics for the CDSS API.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus text
+exposition format by `render()` for the `/metrics` endpoint. Kept dependency-free
+so the cloud VM doesn't need prometheus_client.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# Seconds; spans cache hits (ms) through slow GPT-4 completions (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return "\n".join(lines)
+    
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+    
+    @contextmanager
+    def track(self, **labels):
+        """Increment for the duration of a block (e.g. in-flight requests)"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            state["counts"][bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+    
+    def _render_value(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.label_names, key, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {state['sum']}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+    
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+    
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+    
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+    
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+class StageTimer:
+    """Collects per-stage wall-clock timings (in ms) for one request"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+    
+    @contextmanager
+    def stage(self, name: str):
+        stage_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - stage_start) * 1000)
+    
+    def record(self, name: str, elapsed_ms: float):
+        self.timings[f"{name}_ms"] = self.timings.get(f"{name}_ms", 0) + elapsed_ms
+    
+    def elapsed_ms(self) -> int:
+        return int((time.perf_counter() - self.start) * 1000)
+    
+    def rounded(self) -> Dict[str, int]:
+        """Stage timings rounded to whole ms, plus total_ms so far"""
+        timings = {name: int(round(value)) for name, value in self.timings.items()}
+        timings["total_ms"] = self.elapsed_ms()
+        return timings
+
+
+class RollingPercentile:
+    """Percentile over the most recent `size` observations"""
+    
+    def __init__(self, size: int = 200):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float):
+        with self._lock:
+            self._values.append(value)
+    
+    def __len__(self) -> int:
+        return len(self._values)
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-th percentile (0-100) of the window, or None while it is empty"""
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+registry = Registry()
+
+STAGE_LATENCY = registry.histogram(
+    "cdss_stage_latency_seconds", "Latency of each query pipeline stage", ("stage",))
+REQUEST_LATENCY = registry.histogram(
+    "cdss_request_latency_seconds", "End-to-end server latency per request", ("endpoint", "query_type"))
+IN_FLIGHT = registry.gauge(
+    "cdss_requests_in_flight", "Requests currently being processed", ("endpoint",))
+REQUESTS = registry.counter(
+    "cdss_requests_total", "Requests served", ("endpoint", "device_id", "query_type"))
+TOKENS = registry.counter(
+    "cdss_tokens_total", "OpenAI tokens used", ("device_id", "kind"))
+ERRORS = registry.counter(
+    "cdss_errors_total", "Requests that failed", ("endpoint", "device_id"))
+ANSWER_CACHE = registry.gauge(
+    "cdss_answer_cache", "Answer cache counters (hits, misses, evictions, entries)", ("stat",))
+TTS_CACHE = registry.gauge(
+    "cdss_tts_cache", "TTS audio cache counters (hits, misses, evictions, entries, bytes)", ("stat",))
+MODEL_TIER = registry.counter(
+    "cdss_model_tier_total", "Generated answers per model tier and routing reason", ("tier", "reason"))
+LLM_HEDGES = registry.counter(
+    "cdss_llm_hedges_total", "Completions that fired a hedge request after a slow first token", ("model",))
+LLM_HEDGE_WINS = registry.counter(
+    "cdss_llm_hedge_wins_total", "Hedged completions by the attempt that answered first", ("model", "winner"))
+WS_SESSIONS = registry.gauge(
+    "cdss_websocket_sessions", "Open edge-device WebSocket sessions")
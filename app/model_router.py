@@ -0,0 +1,69 @@
+"""Routing of each query to a fast or strong model tier.
+
+Simple lookups ("TXA dose") answered from a confidently retrieved chunk do
+not need the strongest model; a smaller one answers them as well in a
+fraction of the time. Multi-step or comparative questions, long queries and
+weak retrieval go to the strong tier. Each tier has its own request timeout.
+"""
+import os
+import re
+from typing import Dict, Optional
+
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+
+TIERS = {
+    "fast": {
+        "model": os.getenv("FAST_MODEL", "gpt-4o-mini"),
+        "timeout_s": float(os.getenv("FAST_TIMEOUT_S", 20))
+    },
+    "strong": {
+        "model": os.getenv("STRONG_MODEL", "gpt-4"),
+        "timeout_s": float(os.getenv("STRONG_TIMEOUT_S", os.getenv("OPENAI_TIMEOUT_S", 60)))
+    }
+}
+
+# Queries longer than this are usually multi-part
+LONG_QUERY_WORDS = int(os.getenv("ROUTER_LONG_QUERY_WORDS", 20))
+# Best passage confidence (1 - distance, as in the response sources) needed for the fast tier
+MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", 0.25))
+
+LOOKUP_PATTERN = re.compile(
+    r"\b(dose|dosage|dosing|how much|how many|mg|mcg|rate|route|concentration|max(imum)?|"
+    r"what is|when (do|to|should)|indication|size|setting|volume|interval)\b", re.I)
+COMPLEX_PATTERN = re.compile(
+    r"\b(compare|comparison|versus|vs\.?|difference|differential|why|explain|"
+    r"approach|plan|manage(ment)?|steps?|sequence|prioriti[sz]e|triage|"
+    r"contraindicat\w*|interaction|pregnan\w*|pediatric|child|infant|"
+    r"multiple|both|polytrauma|if\b.+\bthen)\b", re.I)
+
+
+def classify_intent(query: str) -> str:
+    """Intent of a query: complex (multi-step or comparative), lookup (single fact) or general"""
+    if COMPLEX_PATTERN.search(query):
+        return "complex"
+    if LOOKUP_PATTERN.search(query):
+        return "lookup"
+    return "general"
+
+
+def route(query: str, retrieval_confidence: Optional[float] = None) -> Dict:
+    """Pick the tier for a query: {tier, model, timeout_s, intent, reason}"""
+    intent = classify_intent(query)
+
+    if not MODEL_ROUTING_ENABLED:
+        tier, reason = "strong", "routing_disabled"
+    elif intent == "complex":
+        tier, reason = "strong", "complex_intent"
+    elif len(query.split()) > LONG_QUERY_WORDS:
+        tier, reason = "strong", "long_query"
+    elif retrieval_confidence is None or retrieval_confidence < MIN_CONFIDENCE:
+        tier, reason = "strong", "low_confidence"
+    else:
+        tier, reason = "fast", f"{intent}_query"
+
+    return {"tier": tier, "intent": intent, "reason": reason, **TIERS[tier]}
+
+
+def escalate(decision: Dict) -> Dict:
+    """The strong-tier decision to retry with after the fast tier timed out"""
+    return {**decision, "tier": "strong", "reason": "fast_timeout", **TIERS["strong"]}
@@ -1,29 +1,102 @@
-from openai import OpenAI
+from openai import APITimeoutError, AsyncOpenAI
+import asyncio
+import json
 import os
-from typing import List, Dict
+import re
+from typing import AsyncIterator, Callable, List, Dict, Optional
 import time
 
+from metrics import LLM_HEDGES, LLM_HEDGE_WINS, RollingPercentile
+from model_router import escalate, route
+
+SYSTEM_PROMPT = """You are a medical AI assistant providing clinical decision support 
+for emergency medical services and trauma care. You have access to Joint Trauma System 
+clinical practice guidelines. Provide clear, evidence-based guidance while emphasizing 
+that this is educational information and not a replacement for clinical judgment.
+
+CRITICAL: Always include appropriate medical disclaimers and emphasize consulting 
+qualified healthcare professionals for actual patient care."""
+
+# Brief profile for voice queries: spoken, not read, so only the actionable fields are generated
+BRIEF_SYSTEM_PROMPT = """You are a clinical decision support assistant answering a medic by voice 
+in the field, using Joint Trauma System clinical practice guidelines.
+
+Respond with only a JSON object and no other text:
+{"summary": "<one short sentence answering the question>",
+ "actions": ["<imperative step>", ...],
+ "doses": ["<drug, dose, route>", ...]}
+
+It will be spoken aloud: at most 4 actions and 3 doses, a few words each, no markdown. 
+Use only the protocol excerpts provided. If they don't answer the question, say so in the 
+summary and leave the lists empty."""
+BRIEF_MAX_TOKENS = int(os.getenv("BRIEF_MAX_TOKENS", 200))
+
+TTS_MODEL = "tts-1"
+
+# Hedged completions: if no token has arrived after the rolling p90 time to
+# first token (per model), a second identical request is fired and whichever
+# streams first is kept; the other is cancelled.
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 90))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))  # No hedging until the window has this many
+HEDGE_MIN_DELAY_S = float(os.getenv("HEDGE_MIN_DELAY_S", 1.0))  # Floor on the threshold, bounds the hedge rate
+HEDGE_WINDOW = 200
+
+def parse_brief(text: str) -> Dict:
+    """Parse a brief-profile completion into {summary, actions, doses}.
+    
+    Tolerates code fences or prose around the JSON object; if no object can
+    be parsed the whole text becomes the summary.
+    """
+    match = re.search(r"\{.*\}", text, re.S)
+    try:
+        data = json.loads(match.group(0) if match else text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {"summary": text.strip(), "actions": [], "doses": []}
+    return {
+        "summary": str(data.get("summary") or "").strip(),
+        "actions": [str(item).strip() for item in data.get("actions") or [] if str(item).strip()],
+        "doses": [str(item).strip() for item in data.get("doses") or [] if str(item).strip()]
+    }
+
+def render_brief(brief: Dict) -> str:
+    """Plain-text rendering of a brief answer for the screen and the response field"""
+    lines = [brief["summary"]]
+    if brief["actions"]:
+        lines += ["", "WHAT TO DO NOW:"] + [f"- {action}" for action in brief["actions"]]
+    if brief["doses"]:
+        lines += ["", "DOSE & VOLUME:"] + [f"- {dose}" for dose in brief["doses"]]
+    return "\n".join(lines)
+
 class OpenAIClient:
-    def __init__(self):
+    def __init__(self, http_client=None):
+        """`http_client`: an httpx.AsyncClient to share (e.g. with tuned pool limits); the SDK's default otherwise"""
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment")
-        self.client = OpenAI(api_key=api_key)
+        # Async client so a slow completion never blocks the server's event loop
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=float(os.getenv("OPENAI_TIMEOUT_S", 60)),
+            http_client=http_client
+        )
+        self.first_token_s: Dict[str, RollingPercentile] = {}  # model -> recent times to first token
     
-    def generate_response(self, query: str, context_documents: List[str]) -> str:
-        """Generate a response using GPT-4 with retrieved context"""
+    def _build_messages(self, query: str, context_documents: List[str],
+                        voice_mode: Optional[str] = None) -> List[Dict]:
+        """Build the chat messages for a query and its retrieved context"""
         
         # Build context from retrieved documents
         context = "\n\n".join([f"Protocol excerpt:\n{doc}" for doc in context_documents])
         
-        system_prompt = """You are a medical AI assistant providing clinical decision support 
-for emergency medical services and trauma care. You have access to Joint Trauma System 
-clinical practice guidelines. Provide clear, evidence-based guidance while emphasizing 
-that this is educational information and not a replacement for clinical judgment.
-
-CRITICAL: Always include appropriate medical disclaimers and emphasize consulting 
-qualified healthcare professionals for actual patient care."""
-
+        if voice_mode == "brief":
+            return [
+                {"role": "system", "content": BRIEF_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Query: {query}\n\nAvailable Protocols:\n{context}"}
+            ]
+        
         user_prompt = f"""Based on the following medical protocols, answer this query:
 
 Query: {query}
@@ -39,18 +112,230 @@ Provide a clear, structured response with:
 
 Remember: This is educational information only."""
 
-        start_time = time.time()
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+    
+    async def _stream_completion(self, decision: Dict, on_request: Callable[[Dict], None],
+                                 **kwargs) -> AsyncIterator:
+        """Chunks of a streamed chat completion on the routed tier, with that tier's timeout.
+        
+        A fast-tier timeout before the first token (opening the request or
+        waiting for the token) is not retried on the fast tier; the request
+        goes once to the strong tier instead. Timeouts after the first token
+        propagate. `on_request` gets the decision each time a request is sent,
+        so the last call names the tier that answered.
+        """
+        fast = decision["tier"] == "fast"
+        client = self.client.with_options(timeout=decision["timeout_s"], **({"max_retries": 0} if fast else {}))
+        streamed = False
+        try:
+            on_request(decision)
+            stream = await client.chat.completions.create(
+                model=decision["model"], stream=True, stream_options={"include_usage": True}, **kwargs)
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        streamed = True
+                    yield chunk
+            finally:
+                await stream.close()
+            return
+        except APITimeoutError:
+            if not fast or streamed:
+                raise
         
-        response = self.client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        async for chunk in self._stream_completion(escalate(decision), on_request, **kwargs):
+            yield chunk
+    
+    def _hedge_threshold(self, model: str) -> Optional[float]:
+        """Seconds to wait for a first token before hedging, or None to not hedge"""
+        window = self.first_token_s.get(model)
+        if not HEDGING_ENABLED or window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY_S, window.percentile(HEDGE_PERCENTILE))
+    
+    async def _completion_attempt(self, decision: Dict, on_first_token, **kwargs) -> Dict:
+        """One streamed completion, collected: {content, usage, decision, request_start, first_token}.
+        
+        `request_start` is when the request of the answering tier was sent
+        (later than the attempt's start after an escalation) and
+        `first_token` when its first token arrived, both perf_counter().
+        """
+        request = {}
+        
+        def on_request(answering: Dict):
+            request.update(decision=answering, start=time.perf_counter())
+        
+        chunks = self._stream_completion(decision, on_request, **kwargs)
+        first_token = None
+        parts = []
+        usage = None
+        try:
+            async for chunk in chunks:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        first_token = time.perf_counter()
+                        on_first_token()
+                    parts.append(chunk.choices[0].delta.content)
+        finally:
+            # Also runs when this attempt loses a hedge race and is cancelled
+            await chunks.aclose()
+        return {"content": "".join(parts), "usage": usage, "decision": request["decision"],
+                "request_start": request["start"], "first_token": first_token or time.perf_counter()}
+    
+    async def _hedged_completion(self, decision: Dict, **kwargs) -> Dict:
+        """Completion that is re-requested if its first token is slower than usual.
+        
+        Attempts report in on their first token (or when they finish or fail);
+        the first to stream wins and the other is cancelled. A failed attempt
+        only loses if another is still running.
+        """
+        model = decision["model"]
+        threshold = self._hedge_threshold(model)
+        started = time.perf_counter()
+        reported = asyncio.Queue()
+        
+        def launch() -> asyncio.Task:
+            task = asyncio.ensure_future(
+                self._completion_attempt(decision, lambda: reported.put_nowait(task), **kwargs))
+            task.add_done_callback(reported.put_nowait)
+            return task
+        
+        def failed(task: asyncio.Task) -> bool:
+            return task.done() and task.exception() is not None
+        
+        attempts = [launch()]
+        winner = None
+        try:
+            try:
+                winner = await asyncio.wait_for(reported.get(), threshold)
+            except asyncio.TimeoutError:
+                LLM_HEDGES.inc(model=model)
+                attempts.append(launch())
+                winner = await reported.get()
+            while failed(winner) and not all(failed(task) for task in attempts):
+                winner = await reported.get()
+            result = await winner
+        finally:
+            for task in attempts:
+                if task is not winner:
+                    task.cancel()
+        
+        # Hedged requests are observed too (as the time to the winner's first token)
+        # so the window keeps the slow tail the threshold is cut from. An escalated
+        # answer is a sample for the strong model, timed from its own request.
+        answered = result["decision"]["model"]
+        since = started if answered == model else result["request_start"]
+        self.first_token_s.setdefault(answered, RollingPercentile(HEDGE_WINDOW)).observe(result["first_token"] - since)
+        
+        result["hedged"] = len(attempts) > 1
+        if result["hedged"]:
+            LLM_HEDGE_WINS.inc(model=model, winner="primary" if winner is attempts[0] else "hedge")
+        return result
+    
+    async def close(self):
+        await self.client.close()
+    
+    async def generate_response(self, query: str, context_documents: List[str],
+                                voice_mode: Optional[str] = None,
+                                retrieval_confidence: Optional[float] = None) -> Dict:
+        """Generate a response on the routed model tier with retrieved context.
+        
+        Returns the response text with prompt/LLM timings (ms), token usage and
+        the tier/model that answered (see model_router.py). The completion is
+        hedged when its first token is unusually slow (`hedged` in the result). With
+        voice_mode="brief" the brief profile is used and the result also
+        carries `brief`: {summary, actions, doses}.
+        """
+        brief = voice_mode == "brief"
+        prompt_start = time.perf_counter()
+        messages = self._build_messages(query, context_documents, voice_mode)
+        prompt_ms = (time.perf_counter() - prompt_start) * 1000
+        
+        start_time = time.perf_counter()
+        
+        completion = await self._hedged_completion(
+            route(query, retrieval_confidence),
+            messages=messages,
             temperature=0.3,  # Lower temperature for more consistent medical info
-            max_tokens=1000
+            max_tokens=BRIEF_MAX_TOKENS if brief else 1000
         )
         
-        processing_time = int((time.time() - start_time) * 1000)
+        llm_ms = (time.perf_counter() - start_time) * 1000
+        content = completion["content"]
+        usage = completion["usage"]
+        decision = completion["decision"]
+        
+        result = {
+            "response": content,
+            "prompt_ms": prompt_ms,
+            "llm_ms": llm_ms,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "model_tier": decision["tier"],
+            "model": decision["model"],
+            "route_reason": decision["reason"],
+            "hedged": completion["hedged"]
+        }
+        if brief:
+            result["brief"] = parse_brief(content)
+            result["response"] = render_brief(result["brief"])
+        return result
+    
+    async def stream_response(self, query: str, context_documents: List[str],
+                              stats: Optional[Dict] = None,
+                              retrieval_confidence: Optional[float] = None) -> AsyncIterator[str]:
+        """Stream a response from the routed model tier token by token as it is generated.
+        
+        If `stats` is given it is filled with prompt_ms, token usage and the
+        tier/model that answered.
+        """
+        prompt_start = time.perf_counter()
+        messages = self._build_messages(query, context_documents)
+        if stats is None:
+            stats = {}
+        stats["prompt_ms"] = (time.perf_counter() - prompt_start) * 1000
         
-        return response.choices[0].message.content, processing_time
+        def on_request(decision: Dict):
+            stats.update(model_tier=decision["tier"], model=decision["model"], route_reason=decision["reason"])
+        
+        chunks = self._stream_completion(
+            route(query, retrieval_confidence),
+            on_request,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=1000
+        )
+        try:
+            async for chunk in chunks:
+                if chunk.usage:
+                    stats["prompt_tokens"] = chunk.usage.prompt_tokens
+                    stats["completion_tokens"] = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await chunks.aclose()
+    
+    async def transcribe(self, filename: str, audio: bytes) -> str:
+        """Transcribe a spoken query with Whisper (any format Whisper accepts)"""
+        transcript = await self.client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, audio),
+            language="en"
+        )
+        return transcript.text.strip()
+    
+    async def synthesize_speech(self, text: str, voice: str = "echo") -> AsyncIterator[bytes]:
+        """Stream MP3 speech for `text` as it is synthesized"""
+        async with self.client.audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=text,
+            response_format="mp3"
+        ) as response:
+            async for chunk in response.iter_bytes(4096):
+                yield chunk
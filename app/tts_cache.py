@@ -0,0 +1,113 @@
+"""Content-addressed cache of synthesized speech.
+
+Greetings, error prompts and the spoken summaries of common queries are
+the same text every time, so their audio is stored on disk keyed by
+sha256(normalized text | voice | model | speed) and replayed instead of
+calling TTS again. Total size is capped; the least recently played files
+are evicted first. The edge client imports this module too, so it uses
+only the standard library.
+"""
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from typing import Dict, Optional
+
+
+def normalize_text(text: str) -> str:
+    """Text as TTS hears it: Unicode-normalized with whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text: str, voice: str, model: str, speed: float) -> str:
+    return hashlib.sha256(f"{normalize_text(text)}|{voice}|{model}|{speed}".encode()).hexdigest()
+
+
+class TTSCache:
+    """Disk-backed LRU of audio files, one `<key>.<format>` file per phrase"""
+    
+    def __init__(self, directory: str, max_bytes: int = 100 * 1024 * 1024, audio_format: str = "mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.audio_format = audio_format
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        
+        # key -> (size, last use); file mtimes carry recency across restarts
+        self._entries: Dict[str, list] = {}
+        suffix = f".{audio_format}"
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                stat = os.stat(os.path.join(directory, name))
+                self._entries[name[:-len(suffix)]] = [stat.st_size, stat.st_mtime]
+        self._total_bytes = sum(size for size, _ in self._entries.values())
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.{self.audio_format}")
+    
+    def get(self, text: str, voice: str, model: str, speed: float = 1.0) -> Optional[bytes]:
+        key = cache_key(text, voice, model, speed)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    audio = f.read()
+                os.utime(path)
+            except OSError:
+                # Removed behind our back; forget it
+                size, _ = self._entries.pop(key)
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._entries[key][1] = time.time()
+            self.hits += 1
+            return audio
+    
+    def put(self, text: str, voice: str, model: str, audio: bytes, speed: float = 1.0):
+        if not audio or len(audio) > self.max_bytes:
+            return
+        key = cache_key(text, voice, model, speed)
+        path = self._path(key)
+        with self._lock:
+            # Write to a temp file and rename so a crash never leaves a truncated clip
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+            
+            previous = self._entries.get(key)
+            if previous:
+                self._total_bytes -= previous[0]
+            self._entries[key] = [len(audio), time.time()]
+            self._total_bytes += len(audio)
+            self._evict()
+    
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = min(self._entries, key=lambda k: self._entries[k][1])
+            size, _ = self._entries.pop(key)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+    
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -0,0 +1,77 @@
+"""Condensing a generated answer into something worth speaking.
+
+A full answer is written for the screen: headings, numbered lists,
+disclaimers. Read out in full it runs to minutes. `condense_for_voice` keeps
+the action and dose items when the answer uses the field-response sections,
+otherwise the first few substantive sentences, capped at a word budget.
+Brief-mode answers are already structured; `speak_brief` just joins them.
+"""
+import re
+from typing import List
+
+ACTION_HEADINGS = ("WHAT TO DO NOW", "DOSE & VOLUME")
+STOP_HEADINGS = ("CONTRAINDICATIONS", "MONITOR")
+
+# Lines that are boilerplate rather than guidance
+SKIP_PATTERN = re.compile(r"educational|disclaimer|consult|clinical judgment|not a replacement", re.I)
+MARKUP_PATTERN = re.compile(r"^\s*(?:#+|[-*•]|\d+[.)])\s*|\*\*|__|`")
+
+
+def _strip_markup(line: str) -> str:
+    return MARKUP_PATTERN.sub("", line).strip()
+
+
+def _section_items(lines: List[str]) -> List[str]:
+    """Bullet items under the WHAT TO DO NOW / DOSE & VOLUME headings"""
+    items = []
+    in_section = False
+    for line in lines:
+        upper = line.upper()
+        if any(heading in upper for heading in ACTION_HEADINGS):
+            in_section = True
+            continue
+        if any(heading in upper for heading in STOP_HEADINGS):
+            break
+        if in_section and line.strip().startswith(("-", "*", "•")):
+            items.append(_strip_markup(line))
+    return items
+
+
+def _sentences(lines: List[str]) -> List[str]:
+    """Substantive sentences in reading order, skipping headings and disclaimers"""
+    sentences = []
+    for line in lines:
+        text = _strip_markup(line)
+        # Headings ("## Direct answer", "Key protocol points:") carry no guidance of their own
+        if not text or line.lstrip().startswith("#") or text.endswith(":") or SKIP_PATTERN.search(text):
+            continue
+        sentences.extend(s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip())
+    return sentences
+
+
+def condense_for_voice(text: str, max_items: int = 4, max_words: int = 60) -> str:
+    """Short spoken version of an answer: at most `max_items` items and `max_words` words"""
+    lines = text.split("\n")
+    items = _section_items(lines) or _sentences(lines)
+
+    spoken = []
+    words = 0
+    for item in items[:max_items]:
+        item_words = len(item.split())
+        if spoken and words + item_words > max_words:
+            break
+        spoken.append(item.rstrip("."))
+        words += item_words
+
+    if not spoken:
+        return "Unable to summarize the guidance. Please check the display."
+    return ". ".join(spoken) + "."
+
+
+def speak_brief(brief: dict, max_items: int = 6) -> str:
+    """Spoken text for a brief answer: the summary, then actions, then doses"""
+    items = [brief.get("summary", "")] + list(brief.get("actions", [])) + list(brief.get("doses", []))
+    spoken = [item.strip().rstrip(".") for item in items if item and item.strip()][:max_items]
+    if not spoken:
+        return "Unable to summarize the guidance. Please check the display."
+    return ". ".join(spoken) + "."
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Persistent WebSocket session from an edge device to the CDSS API (/ws).
+
+The socket is opened once and kept up with heartbeats; if it drops it is
+reopened with exponential backoff. Queries, answer tokens and audio share
+it, so a field link with a 300-800 ms RTT pays the TCP/TLS handshake once
+per shift instead of once per question.
+
+    session = CDSSSession(CLOUD_API_URL, DEVICE_ID)
+    session.start()
+    for event, data in session.query("TXA dose"):
+        ...
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+import websocket  # pip install websocket-client
+
+HEARTBEAT_S = 15  # Ping interval; also keeps NAT/firewall mappings alive
+RECONNECT_MAX_S = 30  # Backoff ceiling between reconnect attempts
+CONNECT_WAIT_S = 5  # How long a request waits for a (re)connecting session
+REQUEST_TIMEOUT_S = 60  # Longest silence tolerated within one request
+AUDIO_CHUNK_BYTES = 16 * 1024
+
+
+class SessionUnavailable(Exception):
+    """The session is not connected; callers fall back to plain HTTP"""
+
+
+def websocket_url(api_url, device_id):
+    """http(s)://host:port -> ws(s)://host:port/ws?device_id=..."""
+    parts = urlsplit(api_url)
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    path = parts.path.rstrip("/") + "/ws"
+    return urlunsplit((scheme, parts.netloc, path, urlencode({"device_id": device_id}), ""))
+
+
+def pack_audio_frame(request_id, payload):
+    encoded = request_id.encode()
+    return bytes([len(encoded)]) + encoded + payload
+
+
+def unpack_audio_frame(frame):
+    length = frame[0]
+    return frame[1:1 + length].decode(), frame[1 + length:]
+
+
+class CDSSSession:
+    """WebSocket session with heartbeats, reconnect and per-request event queues"""
+    
+    def __init__(self, api_url, device_id, heartbeat_s=HEARTBEAT_S):
+        self.url = websocket_url(api_url, device_id)
+        self.heartbeat_s = heartbeat_s
+        self.connected = threading.Event()
+        self.rtt_ms = None  # From the latest ping/pong
+        self.ws = None
+        self.last_pong = 0.0
+        self.closing = False
+        self.send_lock = threading.Lock()
+        self.pending = {}  # request id -> queue of (event, data)
+        self.ids = itertools.count(1)
+    
+    def start(self):
+        threading.Thread(target=self._connection_loop, daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+    
+    def close(self):
+        self.closing = True
+        ws = self.ws
+        if ws:
+            ws.close()
+    
+    # --- Connection management ---
+    
+    def _connection_loop(self):
+        delay = 1
+        while not self.closing:
+            try:
+                ws = websocket.create_connection(self.url, timeout=10, enable_multithread=True)
+            except Exception as e:
+                print(f"⚠️  CDSS session connect failed ({e}), retrying in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+                continue
+            
+            ws.settimeout(None)
+            self.ws = ws
+            self.last_pong = time.time()
+            self.connected.set()
+            delay = 1
+            print("🔗 CDSS session connected")
+            
+            try:
+                self._receive_loop(ws)
+            except Exception as e:
+                if not self.closing:
+                    print(f"⚠️  CDSS session lost: {e}")
+            finally:
+                self.connected.clear()
+                self.ws = None
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+                self._fail_pending("Connection lost")
+    
+    def _receive_loop(self, ws):
+        while True:
+            opcode, data = ws.recv_data()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                return
+            if opcode == websocket.ABNF.OPCODE_BINARY:
+                request_id, payload = unpack_audio_frame(data)
+                self._deliver(request_id, "audio", payload)
+            elif opcode == websocket.ABNF.OPCODE_TEXT:
+                message = json.loads(data.decode())
+                if message["type"] == "pong":
+                    self.last_pong = time.time()
+                    if message.get("ts"):
+                        self.rtt_ms = (self.last_pong - message["ts"]) * 1000
+                else:
+                    self._deliver(message.get("id"), message["type"], message)
+    
+    def _heartbeat_loop(self):
+        while not self.closing:
+            time.sleep(self.heartbeat_s)
+            ws = self.ws
+            if not self.connected.is_set() or ws is None:
+                continue
+            if time.time() - self.last_pong > self.heartbeat_s * 3:
+                # Half-open connection: nothing back for several heartbeats, force a reconnect
+                print("⚠️  CDSS session heartbeat missed, reconnecting")
+                ws.abort()
+                continue
+            try:
+                self._send({"type": "ping", "ts": time.time()})
+            except Exception:
+                pass
+    
+    def _deliver(self, request_id, event, data):
+        events = self.pending.get(request_id)
+        if events is not None:
+            events.put((event, data))
+    
+    def _fail_pending(self, detail):
+        for events in list(self.pending.values()):
+            events.put(("error", {"detail": detail}))
+    
+    def _send(self, message=None, frame=None):
+        ws = self.ws
+        if ws is None:
+            raise SessionUnavailable("CDSS session not connected")
+        with self.send_lock:
+            if frame is not None:
+                ws.send_binary(frame)
+            else:
+                ws.send(json.dumps(message))
+    
+    # --- Requests ---
+    
+    def _request(self, message, final_events, audio=None):
+        """Send one request and yield its (event, data) pairs until a final event"""
+        if not self.connected.wait(CONNECT_WAIT_S):
+            raise SessionUnavailable("CDSS session not connected")
+        
+        request_id = f"r{next(self.ids)}"
+        events = queue.Queue()
+        self.pending[request_id] = events
+        try:
+            self._send({**message, "id": request_id})
+            if audio is not None:
+                for start in range(0, len(audio), AUDIO_CHUNK_BYTES):
+                    self._send(frame=pack_audio_frame(request_id, audio[start:start + AUDIO_CHUNK_BYTES]))
+                self._send({"type": "audio_end", "id": request_id})
+            
+            while True:
+                try:
+                    event, data = events.get(timeout=REQUEST_TIMEOUT_S)
+                except queue.Empty:
+                    try:
+                        self._send({"type": "cancel", "id": request_id})
+                    except Exception:
+                        pass
+                    yield "error", {"detail": "Timed out waiting for the server"}
+                    return
+                yield event, data
+                if event in final_events or event == "error":
+                    return
+        finally:
+            self.pending.pop(request_id, None)
+    
+    def query(self, text, voice_mode=None, deadline_ms=None):
+        """Stream an answer: sources, [fallback,] [brief,] token..., done (or error)"""
+        message = {"type": "query", "query": text, "voice_mode": voice_mode, "deadline_ms": deadline_ms}
+        return self._request(message, {"done"})
+    
+    def speak(self, text, voice="echo"):
+        """Server-side TTS: audio_start, audio (bytes)..., audio_end"""
+        return self._request({"type": "speak", "text": text, "voice": voice}, {"audio_end"})
+    
+    def voice_query(self, filename, audio_bytes, voice="echo", voice_mode="brief", speak=True, deadline_ms=None):
+        """Upload a recording: transcript, the answer events, then voice_text and its audio"""
+        message = {"type": "audio", "filename": filename, "voice": voice, "voice_mode": voice_mode,
+                   "speak": speak, "deadline_ms": deadline_ms}
+        return self._request(message, {"audio_end"} if speak else {"done"}, audio=audio_bytes)
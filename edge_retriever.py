@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Offline protocol retrieval on the edge device.
+
+Searches the index written by scripts/export_edge_index.py:
+
+    meta.json         collection info and per-chunk source/page
+    embeddings.npy    (N, dim) int8 or float16, memory-mapped
+    scales.npy        (N,) float32 per-row scales (int8 only)
+    offsets.npy       (N + 1,) int64 byte offsets into chunks.bin
+    chunks.bin        UTF-8 chunk text, back to back
+    model/            all-MiniLM-L6-v2 ONNX model and tokenizer
+
+Brute-force top-k over ~7k 384-dim int8 rows is a few MB of memory and a
+few ms of NumPy, so the Pi can find protocol excerpts with the satellite
+link down. Query embeddings use the same MiniLM model as the server, run
+with onnxruntime directly so chromadb isn't needed on the device.
+
+    retriever = EdgeRetriever("data/edge_index")
+    for passage in retriever.search("TXA dose", k=3):
+        ...
+"""
+
+import json
+import mmap
+import os
+import time
+
+import numpy as np
+
+BLOCK_ROWS = 4096  # Rows dequantized at a time, bounds the float32 scratch buffer
+
+
+class MiniLMEmbedder:
+    """all-MiniLM-L6-v2 sentence embeddings (mean pooled, L2-normalized), as Chroma computes them"""
+
+    def __init__(self, model_dir, max_length=256):
+        import onnxruntime  # pip install onnxruntime
+        from tokenizers import Tokenizer  # pip install tokenizers
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = os.cpu_count() or 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), sess_options=options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, texts):
+        encoded = self.tokenizer.encode_batch(texts)
+        length = max(len(e.ids) for e in encoded)
+        input_ids = np.zeros((len(encoded), length), dtype=np.int64)
+        attention_mask = np.zeros((len(encoded), length), dtype=np.int64)
+        for row, e in enumerate(encoded):
+            input_ids[row, :len(e.ids)] = e.ids
+            attention_mask[row, :len(e.ids)] = e.attention_mask
+
+        hidden = self.session.run(None, {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids)
+        })[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class EdgeRetriever:
+    """Top-k cosine search over the exported, quantized chunk embeddings"""
+
+    def __init__(self, index_dir, embed=None):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.chunks = self.meta["chunks"]
+
+        self.embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        self.scales = None
+        if self.meta["dtype"] == "int8":
+            self.scales = np.load(os.path.join(index_dir, "scales.npy"))
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"))
+
+        with open(os.path.join(index_dir, "chunks.bin"), "rb") as f:
+            self.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+        # Any callable mapping a list of texts to normalized vectors will do (tests, other models)
+        self.embed = embed or MiniLMEmbedder(os.path.join(index_dir, "model"))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _scores(self, query_vector):
+        """Cosine similarity of the query to every chunk"""
+        scores = np.empty(len(self.chunks), dtype=np.float32)
+        for start in range(0, len(scores), BLOCK_ROWS):
+            block = self.embeddings[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query_vector
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def chunk_text(self, row):
+        return self.text[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def search(self, query, k=3):
+        """Best `k` chunks: [{id, text, source, page, distance, confidence}], best first.
+
+        `distance` is squared L2 between unit vectors (2 - 2 cos), the same
+        scale as the server's Chroma distances, so confidences compare.
+        """
+        if not self.chunks:
+            return []
+        query_vector = np.asarray(self.embed([query])[0], dtype=np.float32)
+        scores = self._scores(query_vector)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        passages = []
+        for row in top:
+            distance = float(2 - 2 * scores[row])
+            passages.append({
+                **self.chunks[row],
+                "text": self.chunk_text(row),
+                "distance": distance,
+                "confidence": max(0.0, 1.0 - distance)
+            })
+        return passages
+
+
+if __name__ == "__main__":
+    import sys
+
+    index_dir = os.getenv("EDGE_INDEX_PATH", os.path.join(os.path.dirname(__file__), "data", "edge_index"))
+    retriever = EdgeRetriever(index_dir)
+    query = " ".join(sys.argv[1:]) or "tranexamic acid dose"
+    start = time.perf_counter()
+    results = retriever.search(query)
+    print(f"🔎 {len(retriever)} chunks searched in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for passage in results:
+        print(f"\n📄 {passage['source']} p.{passage['page']} ({passage['confidence']:.0%})")
+        print(passage["text"][:300])
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Load-test benchmark for the CDSS API.
+
+Starts scripts/fake_openai_server.py and `app.main:app` (pointed at the fake via
+OPENAI_BASE_URL) against a fixture collection built from a fixed set of JTS CPGs,
+replays data/bench/field_queries.txt at each concurrency level and prints a JSON
+report (p50/p95/p99 latency, requests/s, per-stage timings) that can be diffed
+between runs.
+
+    python scripts/benchmark.py --concurrency 1,4,16 --requests 64 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+QUERIES_FILE = REPO_ROOT / "data" / "bench" / "field_queries.txt"
+PROTOCOL_DIR = REPO_ROOT / "data" / "jts_protocols"
+
+# Fixed subset of CPGs so the fixture collection is identical between runs
+FIXTURE_PDFS = [
+    "Damage_Control_Resuscitation_12_Jul_2019_ID18.pdf",
+    "Airway_Management_of_Traumatic_Injuries_17_Jul_2017_ID39.pdf",
+    "Hypothermia_Prevention_Treatment_07_Jun_2023_ID23.pdf",
+    "Whole_Blood_Transfusion_15_May_2018_ID21.pdf",
+    "Wartime_Thoracic_Injury_26_Dec_2018_ID74.pdf",
+    "Traumatic_Brain_Injury_PFC_06_Dec_2017_ID63.pdf",
+    "Pain_Anxiety_Delirium_26_Apr_2021_ID29_v1.2.pdf",
+    "Burn_Care_CPG_10_June_2025_ID12.pdf",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def build_fixture(db_path):
+    """Ingest FIXTURE_PDFS into a fresh collection at db_path"""
+    print(f"Building fixture collection at {db_path}...", file=sys.stderr)
+    pdf_dir = Path(tempfile.mkdtemp(prefix="cdss_bench_pdfs_"))
+    try:
+        for name in FIXTURE_PDFS:
+            os.symlink(PROTOCOL_DIR / name, pdf_dir / name)
+        env = dict(os.environ, CHROMADB_PATH=str(db_path))
+        subprocess.run(
+            [sys.executable, str(REPO_ROOT / "scripts" / "ingest_pdfs.py"), str(pdf_dir)],
+            env=env, check=True, stdout=sys.stderr
+        )
+    finally:
+        shutil.rmtree(pdf_dir, ignore_errors=True)
+
+
+def load_queries():
+    with open(QUERIES_FILE) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * p / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def latency_summary(values):
+    return {
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+        "mean": round(sum(values) / len(values), 1) if values else 0.0,
+        "max": round(max(values), 1) if values else 0.0
+    }
+
+
+def send_query(session, base_url, endpoint, query, device_id):
+    """Send one query; returns (latency_ms, first_byte_ms, timings dict or None)"""
+    payload = {"query": query, "device_id": device_id}
+    start = time.perf_counter()
+    
+    if endpoint == "/query/stream":
+        first_byte_ms = None
+        timings = None
+        with session.post(base_url + endpoint, json=payload, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if first_byte_ms is None:
+                    first_byte_ms = (time.perf_counter() - start) * 1000
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "done":
+                    timings = json.loads(line[len("data: "):]).get("timings")
+                elif line.startswith("data: ") and event == "error":
+                    raise RuntimeError(line)
+        return (time.perf_counter() - start) * 1000, first_byte_ms, timings
+    
+    response = session.post(base_url + endpoint, json=payload, timeout=120)
+    response.raise_for_status()
+    latency_ms = (time.perf_counter() - start) * 1000
+    return latency_ms, latency_ms, response.json().get("timings")
+
+
+def run_level(base_url, endpoint, queries, concurrency, total_requests):
+    """Replay queries at a fixed concurrency and summarize the results"""
+    local = threading.local()
+    
+    def worker(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        query = queries[i % len(queries)]
+        try:
+            return send_query(local.session, base_url, endpoint, query, f"bench-{i % concurrency}")
+        except Exception as e:
+            return e
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(total_requests)))
+    wall_s = time.perf_counter() - start
+    
+    ok = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    
+    stages = {}
+    for _, _, timings in ok:
+        for name, value in (timings or {}).items():
+            stages.setdefault(name, []).append(value)
+    
+    report = {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": len(errors),
+        "wall_s": round(wall_s, 2),
+        "requests_per_s": round(len(ok) / wall_s, 2) if wall_s else 0.0,
+        "latency_ms": latency_summary([r[0] for r in ok]),
+        "first_byte_ms": latency_summary([r[1] for r in ok if r[1] is not None]),
+        "stages_ms": {name: latency_summary(values) for name, values in sorted(stages.items())}
+    }
+    if errors:
+        report["first_error"] = str(errors[0])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CDSS API load-test benchmark")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64,
+                        help="Requests per concurrency level")
+    parser.add_argument("--endpoint", default="/query", choices=["/query", "/query/stream"])
+    parser.add_argument("--llm-latency-ms", type=float, default=800,
+                        help="Fake OpenAI time to first token")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=40,
+                        help="Fake OpenAI token rate")
+    parser.add_argument("--llm-completion-tokens", type=int, default=150)
+    parser.add_argument("--llm-stall-rate", type=float, default=0,
+                        help="Fraction of fake completions that stall before the first token")
+    parser.add_argument("--llm-stall-ms", type=float, default=20000)
+    parser.add_argument("--fixture-db", default=None,
+                        help="Reuse/create the fixture collection here (default: temp dir)")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Leave the answer cache on (off by default so every query reaches the LLM)")
+    parser.add_argument("--output", default=None, help="Write the JSON report here as well as stdout")
+    args = parser.parse_args()
+    
+    levels = [int(c) for c in args.concurrency.split(",")]
+    queries = load_queries()
+    
+    temp_db = None
+    db_path = args.fixture_db
+    if db_path is None:
+        temp_db = tempfile.mkdtemp(prefix="cdss_bench_db_")
+        db_path = temp_db
+    db = Path(db_path)
+    if not db.exists() or not any(db.iterdir()):
+        db.mkdir(parents=True, exist_ok=True)
+        build_fixture(db_path)
+    
+    fake_port, api_port = free_port(), free_port()
+    fake_env = dict(
+        os.environ,
+        FAKE_OPENAI_LATENCY_MS=str(args.llm_latency_ms),
+        FAKE_OPENAI_TOKENS_PER_S=str(args.llm_tokens_per_s),
+        FAKE_OPENAI_COMPLETION_TOKENS=str(args.llm_completion_tokens),
+        FAKE_OPENAI_STALL_RATE=str(args.llm_stall_rate),
+        FAKE_OPENAI_STALL_MS=str(args.llm_stall_ms)
+    )
+    api_env = dict(
+        os.environ,
+        OPENAI_API_KEY="benchmark",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{fake_port}/v1",
+        CHROMADB_PATH=str(db_path),
+        ANSWER_CACHE_ENABLED="true" if args.answer_cache else "false",
+        MAX_CONCURRENT_QUERIES=os.getenv("MAX_CONCURRENT_QUERIES", str(max(levels)))
+    )
+    
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, str(REPO_ROOT / "scripts" / "fake_openai_server.py"), "--port", str(fake_port)],
+            env=fake_env, stdout=sys.stderr
+        ))
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+             "--port", str(api_port), "--log-level", "warning"],
+            env=api_env, cwd=REPO_ROOT, stdout=sys.stderr
+        ))
+        base_url = f"http://127.0.0.1:{api_port}"
+        wait_for(base_url + "/ready")
+        
+        # Warm-up so model loading isn't charged to the first level
+        send_query(requests.Session(), base_url, args.endpoint, queries[0], "bench-warmup")
+        
+        report = {
+            "endpoint": args.endpoint,
+            "fake_llm": {
+                "latency_ms": args.llm_latency_ms,
+                "tokens_per_s": args.llm_tokens_per_s,
+                "completion_tokens": args.llm_completion_tokens
+            },
+            "fixture_pdfs": FIXTURE_PDFS,
+            "documents_indexed": requests.get(base_url + "/health", timeout=5).json().get("documents_indexed"),
+            "levels": []
+        }
+        for concurrency in levels:
+            print(f"Running concurrency={concurrency}...", file=sys.stderr)
+            report["levels"].append(run_level(base_url, args.endpoint, queries, concurrency, args.requests))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        if temp_db:
+            shutil.rmtree(temp_db, ignore_errors=True)
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
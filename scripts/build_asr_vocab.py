@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from embeddings import ChromaDBClient
+from dotenv import load_dotenv
+from collections import Counter
+import argparse
+import re
+
+load_dotenv()
+
+# Words that sit next to a dose or route in the CPGs but aren't drug names
+GENERIC_WORDS = {
+    "give", "given", "dose", "doses", "then", "over", "every", "repeat", "initial", "max",
+    "maximum", "total", "bolus", "infusion", "dilute", "diluted", "administer", "start",
+    "followed", "each", "additional", "reduce", "approx", "approximately", "adult", "adults",
+    "pediatric", "patient", "patients", "weight", "daily", "load", "loading", "drip", "push",
+    "slow", "rate", "titrate", "minutes", "hours", "than", "less", "more", "least", "range",
+    "with", "from", "after", "before", "until", "within", "also", "only", "first", "second",
+    "units", "unit", "single", "twice", "once", "consider", "table", "figure", "page", "level",
+    "route", "orally", "oral", "dosing", "should", "would", "could", "these", "this",
+    "that", "when", "were", "have", "been", "into", "about", "high", "higher", "lower",
+    "april", "examine", "magazine", "initiative", "mixing", "exceed", "concentration", "converting",
+    "supplement", "tablets", "ampules", "dislodged", "infuse", "inject",
+}
+
+# Suffixes shared by most drug names in the guidelines
+DRUG_SUFFIXES = (
+    "mycin", "micin", "cillin", "penem", "floxacin", "cycline", "azole", "prazole", "tidine",
+    "amine", "azepam", "zolam", "fentanil", "fentanyl", "morphone", "codone", "caine", "profen",
+    "parin", "sone", "olone", "olol", "pril", "sartan", "setron", "azine", "uronium", "curium",
+    "barbital", "etomidate", "phrine", "dopamine", "vasopressin", "xamic", "oxone",
+)
+
+# Clinical terms the small general model reliably mangles
+TERM_SUFFIXES = (
+    "emia", "aemia", "itis", "otomy", "ostomy", "ectomy", "osis", "plasty", "pathy", "thorax",
+    "ischemia", "rrhage", "tamponade", "trauma", "embolism",
+)
+
+DOSE_PATTERN = re.compile(
+    r"\b([A-Za-z][A-Za-z-]{3,})\s+(?:\([A-Za-z]+\)\s+)?\d+(?:\.\d+)?\s*"
+    r"(?:mg|mcg|g|gm|ml|meq|iu|units?)(?:/kg)?\b",
+    re.IGNORECASE
+)
+ROUTE_PATTERN = re.compile(r"\b([A-Za-z][A-Za-z-]{3,})\s+(?:IV|IO|IM|PO|SQ|SC|PR|IN)\b")
+WORD_PATTERN = re.compile(r"\b[a-z][a-z-]{4,}\b")
+
+def iter_documents(client, batch_size=1000):
+    """Yield every chunk text in the collection"""
+    total = client.get_collection_count()
+    for offset in range(0, total, batch_size):
+        batch = client.collection.get(limit=batch_size, offset=offset, include=["documents"])
+        yield from batch["documents"]
+
+def mine_terms(documents, min_count=2, dose_ratio=0.15):
+    """Drug names and clinical terms that appear at least `min_count` times.
+    
+    A word is taken as a drug when it is followed by a dose or route in at
+    least `dose_ratio` of its occurrences (ordinary words that happen to
+    precede a dose now and then fall well below that) and is also written in
+    lower case somewhere (author surnames never are), or when it carries a
+    drug or clinical-term suffix.
+    """
+    dosed = Counter()
+    occurrences = Counter()
+    lowercase = set()
+    for document in documents:
+        for match in DOSE_PATTERN.finditer(document):
+            dosed[match.group(1).lower()] += 1
+        for match in ROUTE_PATTERN.finditer(document):
+            dosed[match.group(1).lower()] += 1
+        occurrences.update(WORD_PATTERN.findall(document.lower()))
+        lowercase.update(WORD_PATTERN.findall(document))
+
+    terms = set()
+    for word, count in occurrences.items():
+        if count < min_count or word in GENERIC_WORDS:
+            continue
+        if word.endswith(DRUG_SUFFIXES) or word.endswith(TERM_SUFFIXES):
+            terms.add(word.strip("-"))
+        elif dosed[word] >= min_count and dosed[word] / count >= dose_ratio and word in lowercase:
+            terms.add(word.strip("-"))
+
+    # PDF extraction sometimes drops leading letters ("oriconazole"); keep the full word
+    return sorted(
+        term for term in terms
+        if not any(other != term and other.endswith(term) and occurrences[other] >= occurrences[term]
+                   for other in terms)
+    )
+
+def build_vocabulary(output_path, min_count=2):
+    """Mine the ingested CPG chunks and write one term per line"""
+    client = ChromaDBClient()
+    terms = mine_terms(iter_documents(client), min_count=min_count)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        f.write("# Medical vocabulary for on-device ASR, mined from the ingested JTS CPGs\n")
+        f.write("# Regenerate with: python scripts/build_asr_vocab.py\n")
+        for term in terms:
+            f.write(term + "\n")
+
+    print(f"✅ Wrote {len(terms)} terms to {output_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the edge ASR vocabulary from the ingested CPGs")
+    parser.add_argument("--output", default="data/asr_vocab.txt")
+    parser.add_argument("--min-count", type=int, default=2,
+                        help="Minimum occurrences for a term to be kept")
+    args = parser.parse_args()
+
+    build_vocabulary(args.output, min_count=args.min_count)
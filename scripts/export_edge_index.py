@@ -0,0 +1,101 @@
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+from embeddings import ChromaDBClient
+from dotenv import load_dotenv
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import argparse
+import json
+import shutil
+
+load_dotenv()
+
+# Where Chroma's DefaultEmbeddingFunction keeps the model it embeds the collection with
+MINILM_DIR = Path.home() / ".cache" / "chroma" / "onnx_models" / "all-MiniLM-L6-v2" / "onnx"
+MODEL_FILES = ("model.onnx", "tokenizer.json")
+
+def quantize_int8(vectors):
+    """Symmetric per-row int8: row ≈ q * scale, with max |q| = 127"""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+def export_index(output_dir, dtype="int8", batch_size=1000):
+    """Dump the collection to memory-mappable files for edge_retriever.py"""
+    client = ChromaDBClient()
+    total = client.get_collection_count()
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    embeddings = None
+    scales = np.ones(total, dtype=np.float32)
+    offsets = np.zeros(total + 1, dtype=np.int64)
+    chunks = []
+
+    with open(output / "chunks.bin", "wb") as text_file:
+        for start in range(0, total, batch_size):
+            batch = client.collection.get(limit=batch_size, offset=start,
+                                          include=["embeddings", "documents", "metadatas"])
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(
+                    output / "embeddings.npy", mode="w+", dtype=dtype, shape=(total, vectors.shape[1]))
+
+            rows = slice(start, start + len(vectors))
+            if dtype == "int8":
+                embeddings[rows], scales[rows] = quantize_int8(vectors)
+            else:
+                embeddings[rows] = vectors.astype(np.float16)
+
+            for i, (chunk_id, document, metadata) in enumerate(zip(batch["ids"], batch["documents"],
+                                                                   batch["metadatas"])):
+                encoded = (document or "").encode("utf-8")
+                text_file.write(encoded)
+                offsets[start + i + 1] = offsets[start + i] + len(encoded)
+                metadata = metadata or {}
+                chunks.append({"id": chunk_id, "source": metadata.get("source", "Unknown"),
+                               "page": metadata.get("page")})
+            print(f"  {min(start + batch_size, total)}/{total} chunks")
+
+    if embeddings is None:
+        print("❌ Collection is empty, nothing to export")
+        return
+    embeddings.flush()
+    if dtype == "int8":
+        np.save(output / "scales.npy", scales)
+    np.save(output / "offsets.npy", offsets)
+
+    with open(output / "meta.json", "w") as f:
+        json.dump({
+            "collection": client.collection.name,
+            "embedding_model": "all-MiniLM-L6-v2",
+            "dtype": dtype,
+            "count": total,
+            "dim": int(embeddings.shape[1]),
+            "exported_at": datetime.now().isoformat(),
+            "chunks": chunks
+        }, f)
+
+    if all((MINILM_DIR / name).exists() for name in MODEL_FILES):
+        (output / "model").mkdir(exist_ok=True)
+        for name in MODEL_FILES:
+            shutil.copy2(MINILM_DIR / name, output / "model" / name)
+    else:
+        print(f"⚠️  MiniLM model not found in {MINILM_DIR}; copy {', '.join(MODEL_FILES)} into "
+              f"{output / 'model'} before deploying")
+
+    size_mb = sum(path.stat().st_size for path in output.rglob("*") if path.is_file()) / 1024 / 1024
+    print(f"✅ Exported {total} chunks ({dtype}) to {output} ({size_mb:.1f} MB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the protocol collection for offline edge retrieval")
+    parser.add_argument("--output", default="data/edge_index")
+    parser.add_argument("--dtype", default="int8", choices=["int8", "float16"],
+                        help="Embedding storage type (int8: 4x smaller than float32, float16: 2x)")
+    args = parser.parse_args()
+
+    export_index(args.output, dtype=args.dtype)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API, used by scripts/benchmark.py.
+
+Answers every request with filler text after a configurable time-to-first-token,
+then emits tokens at a fixed rate, so benchmark runs are repeatable and free.
+A fraction of completions can be made to stall before their first token
+(FAKE_OPENAI_STALL_RATE) to reproduce the slow tail that hedging targets.
+Whisper and TTS are stubbed too (fixed transcript, silent MP3 frames) so the
+/voice endpoint can be exercised end to end.
+
+    FAKE_OPENAI_LATENCY_MS=800 FAKE_OPENAI_TOKENS_PER_S=40 \
+        python scripts/fake_openai_server.py --port 9100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY_MS = float(os.getenv("FAKE_OPENAI_LATENCY_MS", 800))
+TOKENS_PER_S = float(os.getenv("FAKE_OPENAI_TOKENS_PER_S", 40))
+COMPLETION_TOKENS = int(os.getenv("FAKE_OPENAI_COMPLETION_TOKENS", 150))
+TRANSCRIPT = os.getenv("FAKE_OPENAI_TRANSCRIPT", "What is the dose of tranexamic acid for hemorrhage?")
+SPEECH_LATENCY_MS = float(os.getenv("FAKE_OPENAI_SPEECH_LATENCY_MS", 300))
+STALL_RATE = float(os.getenv("FAKE_OPENAI_STALL_RATE", 0))
+STALL_MS = float(os.getenv("FAKE_OPENAI_STALL_MS", 20000))
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz), about 26 ms of audio
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+FILLER = ("Per the protocol excerpts provided, assess airway, breathing and circulation, "
+          "control hemorrhage, and reassess frequently. ").split(" ")
+
+app = FastAPI(title="Fake OpenAI API")
+
+
+BRIEF_ANSWER = json.dumps({
+    "summary": "Give tranexamic acid as early as possible for hemorrhage.",
+    "actions": ["Control bleeding", "Give TXA within 3 hours", "Reassess"],
+    "doses": ["TXA 2 g slow IV or IO push"]
+})
+
+
+def _completion_tokens(max_tokens, messages=()):
+    if messages and "JSON object" in (messages[0].get("content") or ""):
+        # Brief voice profile: a short JSON answer, ~4 chars per token
+        return [BRIEF_ANSWER[i:i + 4] for i in range(0, len(BRIEF_ANSWER), 4)]
+    count = min(COMPLETION_TOKENS, max_tokens or COMPLETION_TOKENS)
+    return [FILLER[i % len(FILLER)] + " " for i in range(count)]
+
+
+def _first_token_s():
+    stall = STALL_MS if random.random() < STALL_RATE else 0
+    return (LATENCY_MS + stall) / 1000
+
+
+def _prompt_tokens(messages):
+    # Rough chars-per-token estimate; only used for usage accounting
+    return sum(len(m.get("content") or "") for m in messages) // 4
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    tokens = _completion_tokens(body.get("max_tokens"), body.get("messages", []))
+    usage = {
+        "prompt_tokens": _prompt_tokens(body.get("messages", [])),
+        "completion_tokens": len(tokens),
+        "total_tokens": _prompt_tokens(body.get("messages", [])) + len(tokens)
+    }
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get("model", "gpt-4")
+    first_token_s = _first_token_s()
+    
+    if not body.get("stream"):
+        await asyncio.sleep(first_token_s + len(tokens) / TOKENS_PER_S)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }
+    
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+    
+    async def events():
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            choices = [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices, "usage": chunk_usage}
+            return f"data: {json.dumps(payload)}\n\n"
+        
+        await asyncio.sleep(first_token_s)
+        yield chunk({"role": "assistant", "content": ""})
+        for token in tokens:
+            yield chunk({"content": token})
+            await asyncio.sleep(1 / TOKENS_PER_S)
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk({}, chunk_usage=usage)
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    form = await request.form()
+    await form["file"].read()
+    await asyncio.sleep(LATENCY_MS / 2000)
+    return {"text": TRANSCRIPT}
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    body = await request.json()
+    # Roughly 15 characters of text per second of speech
+    frames = max(1, int(len(body.get("input", "")) / 15 / 0.026))
+    
+    async def audio():
+        await asyncio.sleep(SPEECH_LATENCY_MS / 1000)
+        for start in range(0, frames, 40):
+            yield SILENT_MP3_FRAME * min(40, frames - start)
+            await asyncio.sleep(0.01)
+    
+    return StreamingResponse(audio(), media_type="audio/mpeg")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for benchmarks")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -37,6 +37,7 @@ def ingest_text_file(file_path, source_name):
     # Add to ChromaDB
     print(f"Adding {len(documents)} chunks from {source_name}...")
     client.add_documents(documents, metadatas, ids)
+    client.rebuild_lexical_index()
     print(f"✅ Successfully ingested {source_name}")
     print(f"Total documents in collection: {client.get_collection_count()}")
 
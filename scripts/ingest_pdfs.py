@@ -2,90 +2,242 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-from embeddings import ChromaDBClient
+from embeddings import ChromaDBClient, UPSERT_BATCH_SIZE
 from dotenv import load_dotenv
+import argparse
+import gzip
+import hashlib
+import json
 import pypdf
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 load_dotenv()
 
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+CHUNKER_VERSION = 2  # 2: chunks carry the page they start on
+MANIFEST_NAME = "ingest_manifest.json"
+CHECKPOINT_NAME = "ingest_checkpoint.json"
+
+# Extracted page text per PDF content hash; re-chunking never has to parse a PDF twice
+PDF_TEXT_CACHE_DIR = os.getenv("PDF_TEXT_CACHE_DIR", "./cache/pdf_text")
+
+def file_sha256(path):
+    """Content hash of a file, used to skip PDFs that haven't changed"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_pdf_pages(pdf_path):
+    """Yield the text of each page of a PDF in order"""
+    reader = pypdf.PdfReader(pdf_path)
+    for page in reader.pages:
+        yield (page.extract_text() or "") + "\n\n"
+
+def load_pages(pdf_path, sha256, cache_dir=PDF_TEXT_CACHE_DIR):
+    """Page texts of a PDF and whether they came from the extraction cache.
+    
+    Cache entries are gzipped JSON, {"source": name, "pages": [text, ...]},
+    named by the PDF's sha256 so a revised file is always re-extracted.
+    """
+    cache_path = os.path.join(cache_dir, f"{sha256}.json.gz")
+    if os.path.exists(cache_path):
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            return json.load(f)["pages"], True
+    
+    pages = list(iter_pdf_pages(pdf_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump({"source": Path(pdf_path).name, "pages": pages}, f)
+    os.replace(tmp_path, cache_path)
+    return pages, False
+
 def extract_text_from_pdf(pdf_path):
     """Extract text from a PDF file"""
     try:
-        reader = pypdf.PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n\n"
-        return text
+        return "".join(iter_pdf_pages(pdf_path))
     except Exception as e:
         print(f"Error reading {pdf_path}: {e}")
         return None
 
-def chunk_text(text, chunk_size=1000, overlap=200):
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     """Split text into overlapping chunks"""
-    chunks = []
+    return [chunk for _, chunk in chunk_pages([text], chunk_size, overlap)]
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Split a stream of page texts into overlapping (page number, chunk) pairs.
+    
+    Produces the same windows as chunking the concatenated document, but only
+    ever holds about one page plus one chunk in memory. The page number
+    (1-based) is the page the chunk's first character is on.
+    """
+    step = chunk_size - overlap
+    buffer = ""
+    buffer_start = 0  # Document offset of buffer[0]
+    page_starts = []  # Document offset where each page begins
+    length = 0
+    
+    def page_of(offset, window):
+        leading = len(window) - len(window.lstrip())
+        return bisect_right(page_starts, offset + leading)
+    
+    for page in pages:
+        page_starts.append(length)
+        length += len(page)
+        buffer += page
+        while len(buffer) >= chunk_size:
+            window = buffer[:chunk_size]
+            chunk = window.strip()
+            if chunk:
+                yield page_of(buffer_start, window), chunk
+            buffer = buffer[step:]
+            buffer_start += step
+    
     start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk.strip())
-        start = end - overlap
-    return chunks
+    while start < len(buffer):
+        window = buffer[start:start + chunk_size]
+        chunk = window.strip()
+        if chunk:
+            yield page_of(buffer_start + start, window), chunk
+        start += step
 
-def ingest_pdf_directory(directory_path):
-    """Ingest all PDFs in a directory"""
+def process_pdf(pdf_path, sha256, cache_dir=PDF_TEXT_CACHE_DIR):
+    """Extract (or load cached page text) and chunk one PDF (runs in a worker process)"""
+    try:
+        pages, cached = load_pages(pdf_path, sha256, cache_dir)
+        return pdf_path, list(chunk_pages(pages)), cached, None
+    except Exception as e:
+        return pdf_path, None, False, str(e)
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "chunker": CHUNKER_VERSION, "files": {}}
+
+def save_manifest(manifest, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def print_batch(stats):
+    print(f"    batch {stats['batch']}: {stats['chunks']} chunks, {stats['chunks_per_s']:.0f} chunks/s "
+          f"(embed {stats['embed_ms']:.0f} ms, write {stats['write_ms']:.0f} ms)")
+
+def ingest_pdf_directory(directory_path, workers=None, force=False, batch_size=UPSERT_BATCH_SIZE):
+    """Ingest all new or changed PDFs in a directory.
+    
+    A manifest of file hashes next to the collection records what has been
+    ingested: unchanged PDFs are skipped, revised ones have their old chunks
+    replaced, and chunks of deleted PDFs are removed.
+    """
     
     client = ChromaDBClient()
-    pdf_files = list(Path(directory_path).glob("*.pdf"))
+    pdf_files = sorted(Path(directory_path).glob("*.pdf"))
+    
+    manifest_path = os.path.join(client.db_path, MANIFEST_NAME)
+    checkpoint_path = os.path.join(client.db_path, CHECKPOINT_NAME)
+    manifest = load_manifest(manifest_path)
+    chunking = (CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER_VERSION)
+    if force or (manifest.get("chunk_size"), manifest.get("chunk_overlap"), manifest.get("chunker")) != chunking:
+        # Chunking changed: every file has to be re-chunked (from cached page text where possible)
+        manifest = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "chunker": CHUNKER_VERSION,
+                    "files": manifest["files"]}
+        for entry in manifest["files"].values():
+            entry["sha256"] = None
     
     print(f"Found {len(pdf_files)} PDF files")
     
+    hashes = {pdf_path.name: file_sha256(pdf_path) for pdf_path in pdf_files}
+    changed = [p for p in pdf_files if manifest["files"].get(p.name, {}).get("sha256") != hashes[p.name]]
+    removed = [name for name in manifest["files"] if name not in hashes]
+    
+    print(f"  {len(pdf_files) - len(changed)} unchanged, {len(changed)} new or changed, {len(removed)} removed")
+    
+    for name in removed:
+        client.delete_documents(where={"source": name})
+        del manifest["files"][name]
+        print(f"  🗑️  Removed chunks for deleted file {name}")
+    save_manifest(manifest, manifest_path)
+    
     total_chunks = 0
     
-    for i, pdf_path in enumerate(pdf_files, 1):
-        print(f"\n[{i}/{len(pdf_files)}] Processing: {pdf_path.name}")
-        
-        # Extract text
-        text = extract_text_from_pdf(pdf_path)
-        if not text:
-            continue
-        
-        # Chunk the text
-        chunks = chunk_text(text)
-        print(f"  Created {len(chunks)} chunks")
-        
-        # Prepare for ChromaDB
-        documents = []
-        metadatas = []
-        ids = []
-        
-        for j, chunk in enumerate(chunks):
-            documents.append(chunk)
-            metadatas.append({
-                'source': pdf_path.name,
-                'chunk_id': j,
-                'total_chunks': len(chunks)
-            })
-            ids.append(f"{pdf_path.stem}_{j}")
-        
-        # Add to ChromaDB
-        try:
-            client.add_documents(documents, metadatas, ids)
-            total_chunks += len(chunks)
-            print(f"  ✅ Successfully added to database")
-        except Exception as e:
-            print(f"  ❌ Error adding to database: {e}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_pdf, pdf_path, hashes[pdf_path.name]) for pdf_path in changed]
+        for i, future in enumerate(as_completed(futures), 1):
+            pdf_path, chunks, cached, error = future.result()
+            print(f"\n[{i}/{len(changed)}] Processed: {pdf_path.name}{' (cached text)' if cached else ''}")
+            
+            if error or not chunks:
+                print(f"  ❌ Error reading {pdf_path}: {error or 'no text extracted'}")
+                continue
+            print(f"  Created {len(chunks)} chunks")
+            
+            # Prepare for ChromaDB
+            records = ({
+                'id': f"{pdf_path.stem}_{j}",
+                'document': chunk,
+                'metadata': {
+                    'source': pdf_path.name,
+                    'page': page,
+                    'chunk_id': j,
+                    'total_chunks': len(chunks)
+                }
+            } for j, (page, chunk) in enumerate(chunks))
+            
+            # A crash mid-file leaves a checkpoint; the same file, version and chunking resumes from it
+            checkpoint_key = f"{pdf_path.name}:{hashes[pdf_path.name]}:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{CHUNKER_VERSION}"
+            resume_from = client.checkpoint_committed(checkpoint_path, checkpoint_key)
+            
+            try:
+                if resume_from:
+                    print(f"  ↩️  Resuming after {resume_from} committed chunks")
+                else:
+                    # Replace any chunks from a previous version of this guideline
+                    client.delete_documents(where={"source": pdf_path.name})
+                stats = client.bulk_upsert(records, batch_size=batch_size, checkpoint_path=checkpoint_path,
+                                           checkpoint_key=checkpoint_key, on_batch=print_batch)
+                print(f"  {stats['chunks']} chunks in {stats['batches']} batches, {stats['chunks_per_s']:.0f} chunks/s "
+                      f"(embed {stats['embed_ms']:.0f} ms, write {stats['write_ms']:.0f} ms)")
+                total_chunks += len(chunks)
+                manifest["files"][pdf_path.name] = {"sha256": hashes[pdf_path.name], "chunks": len(chunks)}
+                save_manifest(manifest, manifest_path)
+                print(f"  ✅ Successfully added to database")
+            except Exception as e:
+                print(f"  ❌ Error adding to database: {e}")
+    
+    if changed or removed:
+        # Rebuild the BM25 lexical index used by hybrid retrieval
+        print("\nBuilding lexical (BM25) index...")
+        client.rebuild_lexical_index()
     
     print(f"\n{'='*60}")
     print(f"Ingestion complete!")
     print(f"Total documents in collection: {client.get_collection_count()}")
     print(f"Total chunks added: {total_chunks}")
+    if client.embedding_cache is not None:
+        cache = client.embedding_cache
+        print(f"Embeddings: {cache.hits} reused from cache, {cache.misses} computed")
     print(f"{'='*60}")
 
 if __name__ == "__main__":
-    pdf_dir = "data/jts_protocols"
-    if os.path.exists(pdf_dir):
-        ingest_pdf_directory(pdf_dir)
+    parser = argparse.ArgumentParser(description="Ingest protocol PDFs into ChromaDB")
+    parser.add_argument("pdf_dir", nargs="?", default="data/jts_protocols")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="PDF extraction processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-ingest every PDF even if unchanged")
+    parser.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE,
+                        help="Chunks embedded and written per batch")
+    args = parser.parse_args()
+    
+    if os.path.exists(args.pdf_dir):
+        ingest_pdf_directory(args.pdf_dir, workers=args.workers, force=args.force, batch_size=args.batch_size)
     else:
-        print(f"Error: Directory {pdf_dir} not found")
+        print(f"Error: Directory {args.pdf_dir} not found")
@@ -19,7 +19,7 @@ echo ""
 echo "Step 1: Installing system dependencies..."
 echo "------------------------------------------------------"
 sudo apt-get update
-sudo apt-get install -y mpg123 alsa-utils
+sudo apt-get install -y mpg123 alsa-utils ffmpeg
 
 echo ""
 echo "Step 2: Testing HDMI audio output..."
@@ -35,8 +35,20 @@ echo "Step 3: Checking Python environment..."
 echo "------------------------------------------------------"
 source venv/bin/activate
 
-# Install/upgrade required packages
-pip install --upgrade openai requests pyaudio python-dotenv
+# Install/upgrade required packages (websocket-client: persistent /ws session, cdss_session.py)
+pip install --upgrade openai requests pyaudio python-dotenv websocket-client
+
+# On-device ASR (vosk_asr.py) and offline protocol search (edge_retriever.py)
+pip install --upgrade vosk numpy onnxruntime tokenizers
+
+# Vosk model for on-device speech recognition (~40 MB)
+VOSK_MODEL=vosk-model-small-en-us-0.15
+if [ ! -d "$VOSK_MODEL" ]; then
+    echo "Downloading Vosk model $VOSK_MODEL..."
+    wget -q "https://alphacephei.com/vosk/models/$VOSK_MODEL.zip" && unzip -q "$VOSK_MODEL.zip" && rm "$VOSK_MODEL.zip" \
+        || echo "⚠️  Vosk model download failed - on-device ASR stays off until $VOSK_MODEL/ exists"
+fi
+mkdir -p data
 
 echo ""
 echo "Step 4: Configuring environment..."
@@ -84,14 +96,47 @@ except Exception as e:
     sys.exit(1)
 EOF
 
+echo ""
+echo "Step 6: Checking optional edge features..."
+echo "------------------------------------------------------"
+python3 << EOF
+import os
+
+def check(name, ok, fix):
+    print(f"  {'✅' if ok else '⚠️ '} {name}" + ("" if ok else f" - {fix}"))
+
+def importable(module):
+    try:
+        __import__(module)
+        return True
+    except Exception:
+        return False
+
+check("TTS cache", os.path.exists("tts_cache.py"), "copy app/tts_cache.py (see step 1 below)")
+check("WebSocket session", importable("websocket") and os.path.exists("cdss_session.py"),
+      "pip install websocket-client and copy cdss_session.py")
+check("On-device ASR", importable("vosk") and os.path.exists("vosk_asr.py")
+      and os.path.isdir("vosk-model-small-en-us-0.15") and os.path.exists("data/asr_vocab.txt"),
+      "pip install vosk, download the Vosk model, copy vosk_asr.py and data/asr_vocab.txt")
+check("Offline protocol search", all(importable(m) for m in ("numpy", "onnxruntime", "tokenizers"))
+      and os.path.exists("edge_retriever.py") and os.path.exists("data/edge_index/meta.json"),
+      "pip install numpy onnxruntime tokenizers, copy edge_retriever.py and an exported data/edge_index")
+EOF
+
 echo ""
 echo "======================================================"
 echo "✅ Setup Complete!"
 echo "======================================================"
 echo ""
 echo "Next steps:"
-echo "1. Copy the new voice client:"
-echo "   scp voice_client_enhanced.py admin@raspberrypi:~/cdss-client/"
+echo "1. Copy the new voice client and its modules (from the repo root):"
+echo "   scp voice_client_enhanced.py cdss_session.py app/tts_cache.py vosk_asr.py edge_retriever.py \\"
+echo "       admin@raspberrypi:~/cdss-client/"
+echo "   scp data/asr_vocab.txt admin@raspberrypi:~/cdss-client/data/"
+echo ""
+echo "   Offline protocol search: export the index where the collection lives, then copy it:"
+echo "   python scripts/export_edge_index.py --output data/edge_index"
+echo "   scp -r data/edge_index admin@raspberrypi:~/cdss-client/data/"
 echo ""
 echo "2. Update the VM server files (from your Mac/local machine):"
 echo "   scp main_enhanced.py akaclinicalco@35.202.102.233:~/cdss-cloud/app/main.py"
@@ -13,10 +13,13 @@ load_dotenv()
 CLOUD_API_URL = os.getenv('CLOUD_API_URL', 'http://localhost:8000')
 DEVICE_ID = os.getenv('DEVICE_ID', 'pi-zero-2w-001')
 
+# Reuse one keep-alive connection across queries
+http = requests.Session()
+
 def send_query(query_text):
     """Send query to cloud API"""
     try:
-        response = requests.post(
+        response = http.post(
             f"{CLOUD_API_URL}/query",
             json={
                 "query": query_text,
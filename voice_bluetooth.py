@@ -15,6 +15,9 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Reuse one keep-alive connection across queries
+http = requests.Session()
+
 print("\n" + "="*70)
 print("  CDSS VOICE CLIENT - BLUETOOTH")
 print("="*70)
@@ -22,11 +25,28 @@ print(f"Cloud: {CLOUD_API_URL}")
 print("Bluetooth: OpenRun Pro by Shokz")
 print("="*70 + "\n")
 
+# Offline wake-word detection with the bundled Vosk model; falls back to Google if unavailable
+try:
+    from vosk_asr import WakeWordDetector
+    wake_detector = WakeWordDetector()
+    print("Wake word: offline (Vosk)\n")
+except Exception as e:
+    wake_detector = None
+    print(f"⚠️  Offline wake word unavailable ({e}), using Google Speech\n")
+
 def listen_for_wake_word():
     """Listen for wake word using Bluetooth mic via PulseAudio"""
     print("🎤 Listening for wake word...")
     print("Say: 'HEY MEDIC' or 'MEDIC'\n")
     
+    if wake_detector:
+        try:
+            phrase = wake_detector.wait()
+            print(f"✅ Wake word: '{phrase}'\n")
+            return True
+        except KeyboardInterrupt:
+            return False
+    
     r = sr.Recognizer()
     
     while True:
@@ -106,7 +126,7 @@ try:
         print("📤 Querying protocols...")
         
         try:
-            resp = requests.post(
+            resp = http.post(
                 f"{CLOUD_API_URL}/query",
                 json={"query": query, "device_id": DEVICE_ID,
                       "timestamp": datetime.now().isoformat()},
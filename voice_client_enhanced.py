@@ -7,18 +7,54 @@ Enhanced CDSS Voice Client
 - HDMI audio output support
 """
 
+import io
+import itertools
 import os
 import sys
+import json
+import math
+import queue
+import re
+import threading
 import time
 import requests
 import pyaudio
 import wave
+from array import array
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
 import subprocess
 
+# app/tts_cache.py in a checkout; copied next to this file on the Pi (see setup_voice.sh)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+try:
+    from tts_cache import TTSCache  # Optional: replay repeated phrases from local storage
+except ImportError:
+    TTSCache = None
+
+try:
+    import webrtcvad  # Optional: more robust than energy VAD in noisy environments
+except ImportError:
+    webrtcvad = None
+
+try:
+    from cdss_session import CDSSSession, SessionUnavailable  # Optional: persistent WebSocket session
+except ImportError:
+    CDSSSession = None
+
+try:
+    from vosk_asr import StreamingTranscriber, load_vocabulary  # Optional: on-device ASR fallback
+except Exception:
+    StreamingTranscriber = None
+
+try:
+    from edge_retriever import EdgeRetriever  # Optional: offline protocol search when the cloud is unreachable
+except ImportError:
+    EdgeRetriever = None
+
 # Load environment variables
 load_dotenv()
 
@@ -29,14 +65,66 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Audio settings
 MICROPHONE_INDEX = 0  # iTalk USB microphone
-SAMPLE_RATE = 44100
+SAMPLE_RATE = 16000  # Whisper works at 16 kHz; no point capturing or uploading more
+FALLBACK_SAMPLE_RATE = 44100  # Used if the mic can't capture at 16 kHz (resampled when encoding)
 CHUNK_SIZE = 1024
 CHANNELS = 1
 RECORD_SECONDS = 15  # Max recording time
 
+# Voice activity detection (stop recording shortly after the medic stops talking)
+VAD_FRAME_MS = 30  # Analysis frame; WebRTC VAD accepts 10, 20 or 30 ms
+VAD_PRE_ROLL_MS = 300  # Audio kept from just before speech was detected
+VAD_SILENCE_MS = int(os.getenv("VAD_SILENCE_MS", 700))  # Trailing silence that ends the query
+VAD_START_TIMEOUT_S = 6  # Give up if no speech starts within this time
+VAD_ENERGY_RATIO = 3.0  # Speech = frame RMS this many times above the noise floor
+VAD_MIN_ENERGY = 300  # RMS floor so a silent room doesn't make every click "speech"
+VAD_TRAILING_MS = 150  # Silence kept after the last speech frame when trimming
+
+# Upload encoding for Whisper: "opus" (smallest), "flac" (lossless) or "wav"
+AUDIO_CODEC = os.getenv("AUDIO_CODEC", "opus")
+OPUS_BITRATE = "24k"
+
+# Speech recognition: "cloud" (Whisper), "local" (Vosk) or "auto" (local when the link is slow)
+ASR_MODE = os.getenv("ASR_MODE", "auto").lower()
+ASR_RTT_THRESHOLD_MS = int(os.getenv("ASR_RTT_THRESHOLD_MS", 800))
+# HTTP link probes older than this are refreshed in the background, never in front of a query
+ASR_RTT_TTL_S = float(os.getenv("ASR_RTT_TTL_S", 30))
+ASR_VOCAB_PATH = os.getenv(
+    "ASR_VOCAB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "asr_vocab.txt")
+)
+
+# "edge": Whisper, /query and TTS called from the Pi; "server": one upload to /voice does all three
+VOICE_PIPELINE = os.getenv("VOICE_PIPELINE", "edge").lower()
+
+# "websocket": one long-lived /ws session for all queries; "http": per-request calls (pooled)
+CDSS_TRANSPORT = os.getenv("CDSS_TRANSPORT", "websocket").lower()
+
+# Stream answers from /query/stream (sources first, then tokens as generated)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+
+# Ask the server for an extractive answer if the full one isn't ready by then (0 = wait for it)
+QUERY_DEADLINE_MS = int(os.getenv("QUERY_DEADLINE_MS", 10000)) or None
+
 # Voice settings
 VOICE_MODE = "brief"  # "brief" or "detailed"
 TTS_VOICE = "echo"  # Options: alloy, echo, fable, onyx, nova, shimmer
+TTS_MIN_SENTENCE_CHARS = 40  # Shorter fragments are merged so each TTS request is worthwhile
+TTS_MODEL = "tts-1"
+# EDGE_ prefix: the server reads TTS_CACHE_* from the same .env for its own, larger cache
+TTS_CACHE_DIR = os.getenv(
+    "EDGE_TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tts")
+)
+TTS_CACHE_MAX_MB = int(os.getenv("EDGE_TTS_CACHE_MAX_MB", 50))  # Repeated phrases play from the SD card
+
+# Exported by scripts/export_edge_index.py; searched locally when the API can't be reached
+EDGE_INDEX_PATH = os.getenv(
+    "EDGE_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "edge_index")
+)
+EDGE_RESULTS = 3
+OFFLINE_VOICE_TEXT = "Network unavailable. Protocol excerpts are on the display."
 
 # Initialize OpenAI client
 if not OPENAI_API_KEY:
@@ -45,6 +133,47 @@ if not OPENAI_API_KEY:
 
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+tts_cache = TTSCache(TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024) if TTSCache else None
+
+# Keep-alive connection pool for HTTP calls to the CDSS API (one TCP/TLS handshake, not one per call)
+http = requests.Session()
+
+# WebSocket session to the CDSS API, started in main() when CDSS_TRANSPORT=websocket
+cdss_session = None
+edge_retriever = None
+
+
+class VoiceActivityDetector:
+    """Frame-level speech detector.
+    
+    Uses WebRTC VAD when installed and the sample rate allows it, otherwise
+    an energy detector against an adaptive noise floor.
+    """
+    
+    def __init__(self, sample_rate=SAMPLE_RATE, aggressiveness=2):
+        self.noise_floor = None
+        self.webrtc = None
+        self.sample_rate = sample_rate
+        if webrtcvad and sample_rate in (8000, 16000, 32000, 48000):
+            self.webrtc = webrtcvad.Vad(aggressiveness)
+    
+    def is_speech(self, frame):
+        samples = array('h', frame)
+        rms = math.sqrt(sum(s * s for s in samples) / len(samples)) if samples else 0.0
+        
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        
+        if self.webrtc:
+            speech = self.webrtc.is_speech(frame, self.sample_rate)
+        else:
+            speech = rms > max(self.noise_floor * VAD_ENERGY_RATIO, VAD_MIN_ENERGY)
+        
+        if not speech:
+            # Track background noise slowly so speech doesn't raise the floor
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
 
 class AudioRecorder:
     """Handle audio recording from USB microphone"""
@@ -52,61 +181,155 @@ class AudioRecorder:
     def __init__(self, device_index=MICROPHONE_INDEX):
         self.device_index = device_index
         self.audio = pyaudio.PyAudio()
+        self.sample_rate = self._pick_sample_rate()
+    
+    def _pick_sample_rate(self):
+        """Capture at 16 kHz when the device supports it"""
+        try:
+            self.audio.is_format_supported(
+                SAMPLE_RATE,
+                input_device=self.device_index,
+                input_channels=CHANNELS,
+                input_format=pyaudio.paInt16
+            )
+            return SAMPLE_RATE
+        except ValueError:
+            return FALLBACK_SAMPLE_RATE
+        
+    def record(self, duration=RECORD_SECONDS, on_frame=None):
+        """Record one spoken query and return (pcm_bytes, sample_rate), or None if no speech.
+        
+        Streams audio through a voice activity detector: recording starts with
+        a short pre-roll once speech is detected and stops after
+        VAD_SILENCE_MS of trailing silence, or at `duration` seconds. The
+        trailing silence is trimmed off before returning.
         
-    def record(self, duration=RECORD_SECONDS):
-        """Record audio and return filename"""
-        print(f"🎤 Recording for up to {duration} seconds... (speak now)")
+        `on_frame` is called with every captured frame from the pre-roll on,
+        so a local recognizer can decode while the medic is still speaking.
+        """
+        print(f"🎤 Listening (up to {duration} seconds)... speak now")
         
+        frame_size = int(self.sample_rate * VAD_FRAME_MS / 1000)
         stream = self.audio.open(
             format=pyaudio.paInt16,
             channels=CHANNELS,
-            rate=SAMPLE_RATE,
+            rate=self.sample_rate,
             input=True,
             input_device_index=self.device_index,
-            frames_per_buffer=CHUNK_SIZE
+            frames_per_buffer=frame_size
         )
         
+        vad = VoiceActivityDetector(self.sample_rate)
+        pre_roll = deque(maxlen=max(1, VAD_PRE_ROLL_MS // VAD_FRAME_MS))
         frames = []
+        speech_run = 0
+        silence_ms = 0
+        last_speech_frame = 0
+        triggered = False
         start_time = time.time()
         
         try:
             while time.time() - start_time < duration:
-                data = stream.read(CHUNK_SIZE, exception_on_overflow=False)
+                data = stream.read(frame_size, exception_on_overflow=False)
+                speech = vad.is_speech(data)
+                
+                if not triggered:
+                    pre_roll.append(data)
+                    speech_run = speech_run + 1 if speech else 0
+                    # Two consecutive speech frames to ignore single clicks
+                    if speech_run >= 2:
+                        triggered = True
+                        frames.extend(pre_roll)
+                        if on_frame:
+                            for frame in pre_roll:
+                                on_frame(frame)
+                        last_speech_frame = len(frames)
+                        print("🗣️  Speech detected...")
+                    elif time.time() - start_time > VAD_START_TIMEOUT_S:
+                        break
+                    continue
+                
                 frames.append(data)
+                if on_frame:
+                    on_frame(data)
+                if speech:
+                    silence_ms = 0
+                    last_speech_frame = len(frames)
+                else:
+                    silence_ms += VAD_FRAME_MS
+                if silence_ms >= VAD_SILENCE_MS:
+                    break
         except KeyboardInterrupt:
             print("\n⏹️  Recording stopped by user")
         
         stream.stop_stream()
         stream.close()
         
-        # Save to temporary file
-        filename = f"/tmp/recording_{int(time.time())}.wav"
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(self.audio.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(SAMPLE_RATE)
-        wf.writeframes(b''.join(frames))
-        wf.close()
+        if not frames:
+            print("❌ No speech detected")
+            return None
+        
+        # Drop the trailing silence that ended the recording
+        frames = frames[:last_speech_frame + VAD_TRAILING_MS // VAD_FRAME_MS]
         
-        print(f"✅ Recording saved: {filename}")
-        return filename
+        print(f"✅ Recorded {len(frames) * VAD_FRAME_MS / 1000:.1f}s of speech")
+        return b''.join(frames), self.sample_rate
     
     def cleanup(self):
         """Clean up audio resources"""
         self.audio.terminate()
 
 
-def transcribe_audio(audio_file):
-    """Transcribe audio using OpenAI Whisper API"""
-    print("🔄 Transcribing with Whisper API...")
+def _wav_bytes(pcm, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(CHANNELS)
+        wf.setsampwidth(2)  # paInt16
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def encode_audio(pcm, sample_rate, codec=AUDIO_CODEC):
+    """Encode 16-bit mono PCM in memory for upload, resampling to 16 kHz.
     
-    try:
-        with open(audio_file, "rb") as f:
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=f,
-                language="en"
+    Returns (filename, bytes). Opus/FLAC go through ffmpeg; falls back to an
+    in-memory WAV if ffmpeg is missing or fails.
+    """
+    if codec in ("opus", "flac"):
+        output_args = {
+            "opus": ["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg"],
+            "flac": ["-c:a", "flac", "-f", "flac"]
+        }[codec]
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-loglevel", "error",
+                 "-f", "s16le", "-ar", str(sample_rate), "-ac", str(CHANNELS), "-i", "pipe:0",
+                 "-ar", str(SAMPLE_RATE), "-ac", "1"] + output_args + ["pipe:1"],
+                input=pcm,
+                capture_output=True
             )
+            if result.returncode == 0 and result.stdout:
+                return f"query.{'ogg' if codec == 'opus' else 'flac'}", result.stdout
+            print(f"⚠️  ffmpeg {codec} encoding failed, sending WAV: {result.stderr.decode().strip()}")
+        except FileNotFoundError:
+            print("⚠️  ffmpeg not installed, sending WAV (sudo apt-get install ffmpeg)")
+    
+    return "query.wav", _wav_bytes(pcm, sample_rate)
+
+
+def transcribe_audio(recording):
+    """Transcribe a (pcm_bytes, sample_rate) recording using OpenAI Whisper API"""
+    pcm, sample_rate = recording
+    filename, audio_bytes = encode_audio(pcm, sample_rate)
+    print(f"🔄 Transcribing with Whisper API ({filename.split('.')[-1]}, {len(audio_bytes) / 1024:.0f} KB)...")
+    
+    try:
+        transcript = openai_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, audio_bytes),
+            language="en"
+        )
         
         text = transcript.text.strip()
         print(f"📝 Transcribed: {text}")
@@ -117,19 +340,143 @@ def transcribe_audio(audio_file):
         return None
 
 
-def query_cdss(medical_query):
-    """Send query to CDSS cloud API"""
+asr_vocabulary = None  # Loaded on first local transcription
+
+
+# Last /health probe: {"rtt_ms": ms or None if unreachable, "measured_at": time.time()}
+link_probe = {"rtt_ms": None, "measured_at": None}
+link_probe_thread = None
+
+
+def probe_link_rtt(attempts=2):
+    """Time `attempts` /health requests and store the best in link_probe"""
+    best = None
+    for _ in range(attempts):
+        try:
+            start = time.time()
+            http.get(f"{CLOUD_API_URL}/health", timeout=ASR_RTT_THRESHOLD_MS / 1000 * 2)
+            rtt = (time.time() - start) * 1000
+            best = rtt if best is None else min(best, rtt)
+        except requests.exceptions.RequestException:
+            pass
+    link_probe.update(rtt_ms=best, measured_at=time.time())
+
+
+def refresh_link_rtt():
+    """Start a background probe unless one is already running"""
+    global link_probe_thread
+    if link_probe_thread is None or not link_probe_thread.is_alive():
+        link_probe_thread = threading.Thread(target=probe_link_rtt, daemon=True)
+        link_probe_thread.start()
+    return link_probe_thread
+
+
+def measure_link_rtt():
+    """Round-trip time to the cloud API in ms, or None if unreachable.
+    
+    Without a connected WebSocket session this is the last background
+    probe's result; a stale one triggers a refresh for the next query. Only
+    the very first call waits for a probe.
+    """
+    if cdss_session and cdss_session.connected.is_set() and cdss_session.rtt_ms is not None:
+        return cdss_session.rtt_ms  # Measured by the session heartbeat, no extra request
+    measured_at = link_probe["measured_at"]
+    if measured_at is None or time.time() - measured_at > ASR_RTT_TTL_S:
+        probe = refresh_link_rtt()
+        if measured_at is None:
+            probe.join()
+    return link_probe["rtt_ms"]
+
+
+def choose_asr():
+    """Pick "local" or "cloud" speech recognition for the next query"""
+    if StreamingTranscriber is None or ASR_MODE == "cloud":
+        return "cloud"
+    if ASR_MODE == "local":
+        return "local"
+    
+    rtt = measure_link_rtt()
+    if rtt is None or rtt > ASR_RTT_THRESHOLD_MS:
+        print(f"📶 Link {'down' if rtt is None else f'slow ({rtt:.0f} ms)'}: using on-device ASR")
+        return "local"
+    return "cloud"
+
+
+def new_local_transcriber(sample_rate):
+    """Vosk transcriber with the CPG vocabulary, or None if the model can't load"""
+    global asr_vocabulary
+    try:
+        if asr_vocabulary is None:
+            asr_vocabulary = load_vocabulary(ASR_VOCAB_PATH)
+        return StreamingTranscriber(sample_rate, asr_vocabulary)
+    except Exception as e:
+        print(f"⚠️  On-device ASR unavailable: {e}")
+        return None
+
+
+def transcribe_locally(transcriber, recording=None):
+    """Finish a streamed local decode, or decode a whole recording after the fact"""
+    print("🔄 Transcribing on-device (Vosk)...")
+    if recording:
+        text = transcriber.transcribe(recording[0])
+    else:
+        text = transcriber.finish()
+    if text:
+        print(f"📝 Transcribed: {text}")
+    return text or None
+
+
+def load_edge_retriever():
+    """Open the offline index if one has been exported to EDGE_INDEX_PATH"""
+    if not EdgeRetriever or not os.path.exists(os.path.join(EDGE_INDEX_PATH, "meta.json")):
+        return None
+    try:
+        retriever = EdgeRetriever(EDGE_INDEX_PATH)
+        print(f"📦 Offline index: {len(retriever)} protocol chunks")
+        return retriever
+    except Exception as e:
+        print(f"⚠️  Could not load offline index: {e}")
+        return None
+
+
+def query_offline(medical_query):
+    """Protocol excerpts from the on-device index, shaped like a /query response"""
+    if edge_retriever is None:
+        return None
+    print("📴 CDSS unreachable, searching protocols on this device")
+    start = time.perf_counter()
+    passages = edge_retriever.search(medical_query, k=EDGE_RESULTS)
+    elapsed_ms = int((time.perf_counter() - start) * 1000)
+    if not passages:
+        return None
+    
+    lines = ["OFFLINE - protocol excerpts, no AI summary:"]
+    for passage in passages:
+        excerpt = " ".join(passage["text"].split())[:400]
+        lines.append(f"- {excerpt} ({passage['source']})")
+    return {
+        "response": "\n".join(lines),
+        "sources": [{"title": p["source"], "page": p["page"], "confidence": round(p["confidence"], 2)}
+                    for p in passages],
+        "query_type": "edge_offline",
+        "processing_time_ms": elapsed_ms
+    }
+
+
+def query_cdss(medical_query, voice_mode=None):
+    """Send query to CDSS cloud API ("brief" voice_mode: short structured answer for speech)"""
     print(f"📤 Querying CDSS: {medical_query}")
     
     payload = {
         "query": medical_query,
         "device_id": DEVICE_ID,
         "timestamp": datetime.now().isoformat(),
-        "voice_mode": VOICE_MODE  # Signal that response should be brief
+        "voice_mode": voice_mode,
+        "deadline_ms": QUERY_DEADLINE_MS
     }
     
     try:
-        response = requests.post(
+        response = http.post(
             f"{CLOUD_API_URL}/query",
             json=payload,
             timeout=60
@@ -146,11 +493,188 @@ def query_cdss(medical_query):
         return None
 
 
+def query_cdss_stream(medical_query, voice_mode=None):
+    """Stream an answer, showing sources and answer text as they arrive.
+    
+    Uses the WebSocket session when it is up, otherwise /query/stream.
+    Returns the same shape of dict as query_cdss so the voice formatting
+    works unchanged.
+    """
+    print(f"📤 Querying CDSS (streaming): {medical_query}")
+    
+    if cdss_session and cdss_session.connected.is_set():
+        try:
+            return _collect_answer(cdss_session.query(medical_query, voice_mode, QUERY_DEADLINE_MS))
+        except SessionUnavailable:
+            print("⚠️  CDSS session dropped, using HTTP")
+    
+    payload = {
+        "query": medical_query,
+        "device_id": DEVICE_ID,
+        "timestamp": datetime.now().isoformat(),
+        "voice_mode": voice_mode,
+        "deadline_ms": QUERY_DEADLINE_MS
+    }
+    
+    try:
+        with http.post(
+            f"{CLOUD_API_URL}/query/stream",
+            json=payload,
+            stream=True,
+            timeout=60
+        ) as response:
+            if response.status_code != 200:
+                print(f"❌ API error: {response.status_code}")
+                return None
+            return _collect_answer(_sse_events(response))
+    
+    except Exception as e:
+        print(f"❌ Query error: {e}")
+        return None
+
+
+def _sse_events(response):
+    """(event, data) pairs from a server-sent events response"""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+
+
+def _collect_answer(events):
+    """Print answer events as they arrive and build the response dict (None on error)"""
+    response_data = {"response": "", "sources": [], "processing_time_ms": 0}
+    for event, data in events:
+        if not _show_answer_event(event, data, response_data):
+            return None
+    return response_data
+
+
+def _show_answer_event(event, data, response_data):
+    """Apply one sources/fallback/brief/token/done/error event; returns False on error"""
+    if event == "sources":
+        response_data["sources"] = data.get("sources", [])
+        response_data["query_type"] = data.get("query_type")
+        print("\n📚 SOURCES:")
+        for i, source in enumerate(response_data["sources"][:3], 1):
+            print(f"  {i}. {source.get('title', 'Unknown')} ({source.get('confidence', 0):.0%})")
+        print("\n" + "="*60)
+    elif event == "fallback":
+        # The full answer is late; show protocol excerpts meanwhile, its tokens follow
+        response_data["fallback"] = data["text"]
+        print(f"⏳ Full answer delayed. {data['text']}")
+        print("-"*60)
+    elif event == "brief":
+        response_data["brief"] = {key: data.get(key) for key in ("summary", "actions", "doses")}
+    elif event == "token":
+        response_data["response"] += data["text"]
+        print(data["text"], end="", flush=True)
+    elif event == "done":
+        response_data["processing_time_ms"] = data.get("processing_time_ms", 0)
+        print("\n" + "="*60)
+        print(f"⏱️  Processing time: {response_data['processing_time_ms']}ms "
+              f"(first token {data.get('time_to_first_token_ms', 0)}ms)")
+    elif event == "error":
+        print(f"\n❌ API error: {data.get('detail')}")
+        return False
+    return True
+
+
+def query_cdss_voice(recording):
+    """Send a recording to /voice: transcription, answer and speech in one round trip.
+    
+    The response is a JSON line (transcript, answer, spoken summary, sources)
+    followed by MP3 audio, which is piped to the player as it downloads.
+    Returns the JSON part, or None so the caller can fall back to the edge
+    pipeline.
+    """
+    pcm, sample_rate = recording
+    filename, audio_bytes = encode_audio(pcm, sample_rate)
+    print(f"📤 Sending query audio to CDSS voice pipeline ({filename.split('.')[-1]}, "
+          f"{len(audio_bytes) / 1024:.0f} KB)...")
+    
+    if cdss_session and cdss_session.connected.is_set():
+        try:
+            return _voice_query_session(filename, audio_bytes)
+        except SessionUnavailable:
+            print("⚠️  CDSS session dropped, using HTTP")
+    
+    try:
+        with http.post(
+            f"{CLOUD_API_URL}/voice",
+            files={"audio": (filename, audio_bytes)},
+            data={"device_id": DEVICE_ID, "voice": TTS_VOICE, "voice_mode": VOICE_MODE,
+                  "deadline_ms": QUERY_DEADLINE_MS},
+            stream=True,
+            timeout=60
+        ) as response:
+            if response.status_code != 200:
+                print(f"❌ Voice API error: {response.status_code} {response.text[:200]}")
+                return None
+            
+            chunks = response.iter_content(4096)
+            buffer = b""
+            for chunk in chunks:
+                buffer += chunk
+                if b"\n" in buffer:
+                    break
+            header, _, audio_start = buffer.partition(b"\n")
+            response_data = json.loads(header)
+            
+            print(f"📝 Heard: {response_data.get('transcript', '')}")
+            display_full_response(response_data)
+            
+            print(f"🔊 Speaking: {response_data.get('voice_text', '')}")
+            player = _open_player()
+            if player:
+                _play_chunks(player, itertools.chain([audio_start], chunks))
+        
+        return response_data
+    
+    except Exception as e:
+        print(f"❌ Voice query error: {e}")
+        return None
+
+
+def _voice_query_session(filename, audio_bytes):
+    """Voice pipeline over the WebSocket session: the answer streams to screen, then its summary plays"""
+    response_data = {"response": "", "sources": [], "processing_time_ms": 0}
+    events = cdss_session.voice_query(filename, audio_bytes, voice=TTS_VOICE, voice_mode=VOICE_MODE,
+                                      deadline_ms=QUERY_DEADLINE_MS)
+    for event, data in events:
+        if event == "transcript":
+            response_data["transcript"] = data["text"]
+            print(f"📝 Heard: {data['text']}")
+        elif event == "voice_text":
+            response_data["voice_text"] = data["text"]
+            print(f"🔊 Speaking: {data['text']}")
+        elif event == "audio_start":
+            player = _open_player()
+            if player:
+                _play_chunks(player, (chunk for kind, chunk in events if kind == "audio"))
+            break
+        elif not _show_answer_event(event, data, response_data):
+            return None
+    return response_data
+
+
 def format_for_voice(response_data):
     """Extract and format response for voice output (condensed)"""
     if not response_data:
         return "No response received from the system."
     
+    # Offline excerpts are for reading; TTS is likely unreachable too unless this phrase is cached
+    if response_data.get("query_type") == "edge_offline":
+        return OFFLINE_VOICE_TEXT
+    
+    # Brief-mode answers arrive already structured for speech
+    brief = response_data.get("brief")
+    if brief:
+        items = [brief.get("summary")] + (brief.get("actions") or []) + (brief.get("doses") or [])
+        return ". ".join(item.strip().rstrip(".") for item in items if item and item.strip()) + "."
+    
     response_text = response_data.get("response", "")
     
     # Extract just the essential action items for voice
@@ -190,48 +714,115 @@ def format_for_voice(response_data):
         return "Unable to parse guidance. Please check the display."
 
 
+def split_sentences(text, min_chars=TTS_MIN_SENTENCE_CHARS):
+    """Split text into sentences for pipelined TTS, merging very short fragments"""
+    pieces = [p.strip() for p in re.split(r'(?<=[.!?;:])\s+|\n+', text) if p.strip()]
+    sentences = []
+    for piece in pieces:
+        if sentences and len(sentences[-1]) < min_chars:
+            sentences[-1] = f"{sentences[-1]} {piece}"
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def _synthesize_sentences(sentences, voice, audio_queue, errors):
+    """Stream TTS audio for each sentence into the queue (runs in a thread).
+    
+    Sentences spoken before come straight from the local TTS cache.
+    """
+    try:
+        for sentence in sentences:
+            cached = tts_cache.get(sentence, voice, TTS_MODEL) if tts_cache else None
+            if cached is not None:
+                audio_queue.put(cached)
+                continue
+            
+            chunks = []
+            with openai_client.audio.speech.with_streaming_response.create(
+                model=TTS_MODEL,
+                voice=voice,
+                input=sentence,
+                speed=1.0,
+                response_format="mp3"
+            ) as response:
+                for chunk in response.iter_bytes(4096):
+                    chunks.append(chunk)
+                    audio_queue.put(chunk)
+            if tts_cache:
+                tts_cache.put(sentence, voice, TTS_MODEL, b"".join(chunks))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        audio_queue.put(None)
+
+
 def speak_response(text, voice=TTS_VOICE):
-    """Convert text to speech and play through HDMI"""
-    print(f"🔊 Generating speech (voice: {voice})...")
+    """Speak text through HDMI, sentence by sentence.
+    
+    The answer is split into sentences; a background thread streams the TTS
+    audio for each one straight into mpg123's stdin, so the first sentence
+    starts playing while later ones are still being synthesized.
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return
+    print(f"🔊 Speaking {len(sentences)} sentence(s) (voice: {voice})...")
+    
+    player = _open_player()
+    if not player:
+        print(f"📄 Text response: {text}")
+        return
+    
+    audio_queue = queue.Queue()
+    errors = []
+    synthesizer = threading.Thread(
+        target=_synthesize_sentences,
+        args=(sentences, voice, audio_queue, errors),
+        daemon=True
+    )
+    synthesizer.start()
     
+    _play_chunks(player, iter(audio_queue.get, None))
+    
+    if errors:
+        print(f"❌ TTS error: {errors[0]}")
+        print(f"📄 Text response: {text}")
+    elif player.returncode != 0:
+        print(f"⚠️  Audio playback warning: {player.stderr.read().decode()}")
+    else:
+        print("✅ Audio playback complete")
+
+
+def _open_player():
+    """Start mpg123 reading MP3 from stdin, or None if it isn't installed"""
     try:
-        # Generate speech with OpenAI TTS
-        response = openai_client.audio.speech.create(
-            model="tts-1",
-            voice=voice,
-            input=text,
-            speed=1.0
-        )
-        
-        # Save to file
-        speech_file = f"/tmp/response_{int(time.time())}.mp3"
-        response.stream_to_file(speech_file)
-        
-        print("▶️  Playing audio...")
-        
-        # Play through HDMI using mpg123 (lightweight, reliable)
+        # Play through HDMI using mpg123 (lightweight, reliable), reading MP3 from stdin
         # Install with: sudo apt-get install mpg123
-        result = subprocess.run(
-            ["mpg123", "-q", speech_file],  # -q for quiet mode
-            capture_output=True
+        return subprocess.Popen(
+            ["mpg123", "-q", "-"],  # -q for quiet mode, - for stdin
+            stdin=subprocess.PIPE,
+            stderr=subprocess.PIPE
         )
-        
-        if result.returncode != 0:
-            print(f"⚠️  Audio playback warning: {result.stderr.decode()}")
-            # Try alternative player
-            subprocess.run(["aplay", "-q", speech_file], capture_output=True)
-        
-        # Cleanup
+    except FileNotFoundError:
+        print("⚠️  mpg123 not installed (sudo apt-get install mpg123)")
+        return None
+
+
+def _play_chunks(player, chunks):
+    """Feed MP3 chunks to the player as they arrive, then wait for playback to end"""
+    try:
+        for chunk in chunks:
+            player.stdin.write(chunk)
+            player.stdin.flush()
+    except BrokenPipeError:
+        print("⚠️  Audio player exited early")
+    finally:
         try:
-            os.remove(speech_file)
-        except:
+            player.stdin.close()
+        except BrokenPipeError:
             pass
-        
-        print("✅ Audio playback complete")
-        
-    except Exception as e:
-        print(f"❌ TTS error: {e}")
-        print(f"📄 Text response: {text}")
+        player.wait()
 
 
 def display_full_response(response_data):
@@ -262,6 +853,7 @@ def display_full_response(response_data):
 
 def main():
     """Main voice client loop"""
+    global cdss_session, edge_retriever
     print("\n" + "="*60)
     print("🎙️  ENHANCED CDSS VOICE CLIENT")
     print("="*60)
@@ -269,9 +861,19 @@ def main():
     print(f"🎤 Microphone: iTalk USB (index {MICROPHONE_INDEX})")
     print(f"🔊 Audio Output: HDMI Monitor")
     print(f"🎯 Voice Mode: {VOICE_MODE.upper()}")
+    print(f"🛰️  Voice Pipeline: {VOICE_PIPELINE}")
+    print(f"🧠 Speech Recognition: {ASR_MODE}{'' if StreamingTranscriber else ' (Vosk not installed: cloud only)'}")
     print(f"🗣️  TTS Voice: {TTS_VOICE}")
     print("="*60)
     
+    # Connect the session in the background while the banner plays
+    if CDSS_TRANSPORT == "websocket" and CDSSSession:
+        cdss_session = CDSSSession(CLOUD_API_URL, DEVICE_ID)
+        cdss_session.start()
+    elif ASR_MODE == "auto" and StreamingTranscriber:
+        refresh_link_rtt()  # First link probe runs while the banner plays
+    edge_retriever = load_edge_retriever()
+    
     # Test audio output
     print("\n🔊 Testing audio output...")
     speak_response("CDSS voice system ready. Press V to start voice mode, T for text mode, or Q to quit.")
@@ -293,17 +895,33 @@ def main():
                 print("Press ENTER when ready to speak...")
                 input()
                 
+                # Local ASR decodes during capture; cloud ASR uploads afterwards
+                transcriber = None
+                asr = choose_asr()
+                if asr == "local":
+                    transcriber = new_local_transcriber(recorder.sample_rate)
+                
                 # Record audio
-                audio_file = recorder.record()
+                recording = recorder.record(on_frame=transcriber.accept if transcriber else None)
+                if not recording:
+                    continue
                 
-                # Transcribe
-                query_text = transcribe_audio(audio_file)
+                # One round trip to /voice does transcription, answer and speech server-side
+                if VOICE_PIPELINE == "server" and asr == "cloud":
+                    if query_cdss_voice(recording):
+                        continue
+                    print("⚠️  Voice pipeline failed, falling back to edge processing")
                 
-                # Cleanup audio file
-                try:
-                    os.remove(audio_file)
-                except:
-                    pass
+                # Transcribe
+                if transcriber:
+                    query_text = transcribe_locally(transcriber)
+                else:
+                    query_text = transcribe_audio(recording)
+                    if not query_text and StreamingTranscriber and ASR_MODE != "cloud":
+                        # Whisper unreachable: decode the same audio on-device
+                        transcriber = new_local_transcriber(recorder.sample_rate)
+                        if transcriber:
+                            query_text = transcribe_locally(transcriber, recording)
                 
                 if not query_text:
                     print("❌ Could not understand audio. Please try again.")
@@ -318,12 +936,17 @@ def main():
                     continue
                 
                 # Query CDSS
-                response_data = query_cdss(query_text)
-                
-                if response_data:
+                if STREAM_RESPONSES:
+                    response_data = query_cdss_stream(query_text, VOICE_MODE)
+                else:
+                    response_data = query_cdss(query_text, VOICE_MODE)
                     # Show full response on screen
                     display_full_response(response_data)
-                    
+                if not response_data:
+                    response_data = query_offline(query_text)
+                    display_full_response(response_data)
+                
+                if response_data:
                     # Speak condensed version
                     voice_text = format_for_voice(response_data)
                     speak_response(voice_text)
@@ -337,12 +960,17 @@ def main():
                     continue
                 
                 # Query CDSS
-                response_data = query_cdss(query_text)
-                
-                if response_data:
+                if STREAM_RESPONSES:
+                    response_data = query_cdss_stream(query_text)
+                else:
+                    response_data = query_cdss(query_text)
                     # Show full response on screen
                     display_full_response(response_data)
-                    
+                if not response_data:
+                    response_data = query_offline(query_text)
+                    display_full_response(response_data)
+                
+                if response_data:
                     # Option to speak response
                     speak_opt = input("Speak response? [y/n]: ").lower().strip()
                     if speak_opt == 'y':
@@ -357,6 +985,8 @@ def main():
     
     finally:
         recorder.cleanup()
+        if cdss_session:
+            cdss_session.close()
         print("\n✅ Voice client stopped")
 
 
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+On-device speech recognition with the bundled Vosk model.
+
+- WakeWordDetector: continuous, offline "medic" wake-word spotting using a
+  grammar restricted to the wake phrases (no network, low CPU on a Pi 3)
+- StreamingTranscriber: local query transcription decoded while audio is
+  still being captured, with a medical vocabulary correction pass
+"""
+
+import difflib
+import json
+import os
+import threading
+from collections import deque
+
+import pyaudio
+from vosk import KaldiRecognizer, Model, SetLogLevel
+
+VOSK_MODEL_PATH = os.getenv(
+    "VOSK_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "vosk-model-small-en-us-0.15")
+)
+SAMPLE_RATE = 16000  # The small en-us model is trained on 16 kHz audio
+FRAME_SAMPLES = 1600  # 100 ms per read
+WAKE_PHRASES = ["hey medic", "medic"]
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def load_model():
+    """Load the Vosk model once per process (takes a few seconds on a Pi)"""
+    global _model
+    with _model_lock:
+        if _model is None:
+            SetLogLevel(-1)
+            _model = Model(VOSK_MODEL_PATH)
+    return _model
+
+
+class AudioRingBuffer:
+    """Continuous microphone capture into a bounded ring buffer.
+    
+    PyAudio's callback thread appends 100 ms frames; the recognizer drains
+    them. Capture never pauses while decoding, and if decoding falls behind
+    only the oldest audio is dropped.
+    """
+    
+    def __init__(self, device_index=None, seconds=3.0):
+        self.device_index = device_index
+        self.frames = deque(maxlen=max(1, int(seconds * SAMPLE_RATE / FRAME_SAMPLES)))
+        self.available = threading.Event()
+        self.audio = None
+        self.stream = None
+    
+    def _callback(self, in_data, frame_count, time_info, status):
+        self.frames.append(in_data)
+        self.available.set()
+        return (None, pyaudio.paContinue)
+    
+    def start(self):
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=SAMPLE_RATE,
+            input=True,
+            input_device_index=self.device_index,
+            frames_per_buffer=FRAME_SAMPLES,
+            stream_callback=self._callback
+        )
+        self.stream.start_stream()
+    
+    def read(self, timeout=1.0):
+        """Next captured frame, or None if nothing arrived within timeout"""
+        while True:
+            if self.frames:
+                return self.frames.popleft()
+            self.available.clear()
+            # Re-check after clearing so a frame appended in between isn't missed
+            if not self.frames and not self.available.wait(timeout):
+                return None
+    
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+        self.frames.clear()
+
+
+class WakeWordDetector:
+    """Offline wake-word spotting with a grammar limited to the wake phrases"""
+    
+    def __init__(self, phrases=WAKE_PHRASES, device_index=None):
+        self.phrases = [p.lower() for p in phrases]
+        # "[unk]" absorbs all other speech so it can't be forced onto a wake phrase
+        self.recognizer = KaldiRecognizer(load_model(), SAMPLE_RATE, json.dumps(self.phrases + ["[unk]"]))
+        self.device_index = device_index
+    
+    def _match(self, text):
+        for phrase in self.phrases:
+            if phrase in text:
+                return phrase
+        return None
+    
+    def wait(self):
+        """Block until a wake phrase is heard; returns the phrase.
+        
+        The microphone is released on return so the caller can record the query.
+        """
+        buffer = AudioRingBuffer(self.device_index)
+        buffer.start()
+        try:
+            while True:
+                frame = buffer.read()
+                if frame is None:
+                    continue
+                if self.recognizer.AcceptWaveform(frame):
+                    text = json.loads(self.recognizer.Result()).get("text", "")
+                else:
+                    # Partial hypotheses fire as soon as the phrase is spoken
+                    text = json.loads(self.recognizer.PartialResult()).get("partial", "")
+                phrase = self._match(text)
+                if phrase:
+                    self.recognizer.Reset()
+                    return phrase
+        finally:
+            buffer.stop()
+
+
+def load_vocabulary(path):
+    """Read a medical vocabulary file (one term per line, '#' comments)"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [line.strip().lower() for line in f if line.strip() and not line.startswith("#")]
+
+
+class StreamingTranscriber:
+    """Incremental local ASR for a spoken query.
+    
+    Frames are decoded as they are captured (`accept`), so the transcript is
+    ready as soon as speech ends (`finish`). Low-confidence words are snapped
+    to the closest term in a medical vocabulary mined from the CPGs (see
+    scripts/build_asr_vocab.py), which fixes the drug names and abbreviations
+    the small general model tends to split or misspell.
+    """
+    
+    def __init__(self, sample_rate=SAMPLE_RATE, vocabulary=None, min_confidence=0.85, cutoff=0.75):
+        self.recognizer = KaldiRecognizer(load_model(), sample_rate)
+        self.recognizer.SetWords(True)
+        self.vocabulary = sorted(set(vocabulary or []))
+        self.single_words = [term for term in self.vocabulary if " " not in term]
+        self.min_confidence = min_confidence
+        self.cutoff = cutoff
+        self.words = []
+    
+    def accept(self, frame):
+        if self.recognizer.AcceptWaveform(frame):
+            self.words.extend(json.loads(self.recognizer.Result()).get("result", []))
+    
+    def finish(self):
+        """Flush the decoder and return the vocabulary-corrected transcript"""
+        self.words.extend(json.loads(self.recognizer.FinalResult()).get("result", []))
+        text = " ".join(self._apply_vocabulary(self.words))
+        self.words = []
+        self.recognizer.Reset()
+        return text
+    
+    def transcribe(self, pcm, frame_bytes=FRAME_SAMPLES * 2):
+        """Decode a complete recording (when it wasn't streamed through accept)"""
+        for start in range(0, len(pcm), frame_bytes):
+            self.accept(pcm[start:start + frame_bytes])
+        return self.finish()
+    
+    def _uncertain(self, word):
+        return word.get("conf", 1.0) < self.min_confidence
+    
+    def _closest(self, candidate):
+        if candidate in self.vocabulary:
+            return candidate
+        matches = difflib.get_close_matches(candidate, self.single_words, n=1, cutoff=self.cutoff)
+        return matches[0] if matches else None
+    
+    def _apply_vocabulary(self, words):
+        corrected = []
+        i = 0
+        while i < len(words):
+            word = words[i]["word"]
+            uncertain = self._uncertain(words[i])
+            
+            # A drug name is often split in two ("keta mean" -> "ketamine")
+            if uncertain and i + 1 < len(words) and self._uncertain(words[i + 1]) and self.vocabulary:
+                joined = self._closest(word + words[i + 1]["word"])
+                if joined:
+                    corrected.append(joined)
+                    i += 2
+                    continue
+            
+            if uncertain and self.vocabulary:
+                corrected.append(self._closest(word) or word)
+            else:
+                corrected.append(word)
+            i += 1
+        return corrected